@@ -7,5 +7,9 @@ def main():
     win.show()
     Fl.run()
 
+    # Finish writing any recorded games
+    if win.stats is not None:
+        win.stats.close()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
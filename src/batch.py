@@ -0,0 +1,146 @@
+import numpy as np
+
+from protocol import FLEET, HIT, MISS, UNKNOWN
+
+
+class BatchGames:
+    """Many independent games of battleship stepped in lockstep.
+
+    Every game is one shooter firing at one hidden fleet, so a full
+    two player match is just two rows. All state is held in NumPy
+    arrays with the game index as the leading dimension, and every
+    operation works on all games at once without looping over them.
+    """
+
+    def __init__(self, k, size=10, fleet=FLEET, seed=None):
+        """Initialize an instance.
+
+        k is the number of games, size is the number of rows/columns
+        and fleet is the lengths of the ships in each game.
+        """
+
+        self.k = k
+        self.size = size
+        self.lengths = np.array(fleet, dtype=np.int16)
+        self.rng = np.random.default_rng(seed)
+
+        # Index of ship in each cell, -1 for water
+        self.boards = np.full((k, size, size), -1, dtype=np.int8)
+
+        # Batched hit_list, 0 unknown, 1 miss, 2 hit
+        self.shots = np.zeros((k, size, size), dtype=np.int8)
+
+        # Number of times each ship has been hit
+        self.ship_hits = np.zeros((k, len(fleet)), dtype=np.int16)
+
+        # Unhit ship cells left, game is over when this reaches 0
+        self.remaining = np.zeros(k, dtype=np.int16)
+
+        # Shots fired in the current game
+        self.turns = np.zeros(k, dtype=np.int32)
+
+        # Shot counts of the games that ended on the last step
+        self.finished_turns = np.zeros(0, dtype=np.int32)
+
+        # For convenience when indexing one cell per game
+        self.games = np.arange(k)
+
+        self.reset()
+
+    def reset(self, mask=None):
+        """Start new games with random fleets.
+
+        mask is a boolean array of games to reset, all games if None.
+        """
+
+        if mask is None:
+            mask = np.ones(self.k, dtype=bool)
+        games = np.flatnonzero(mask)
+        if not len(games):
+            return
+
+        self.boards[games] = self.random_boards(len(games))
+        self.shots[games] = UNKNOWN
+        self.ship_hits[games] = 0
+        self.remaining[games] = self.lengths.sum()
+        self.turns[games] = 0
+
+    def random_boards(self, n):
+        """Return n boards with randomly placed, non overlapping fleets.
+
+        Ships are placed one at a time for all boards together, boards
+        where the new ship overlaps an old one just try again.
+        """
+
+        size = self.size
+        boards = np.full((n, size, size), -1, dtype=np.int8)
+        rows = np.arange(n)
+
+        for i, length in enumerate(self.lengths):
+            todo = rows
+            steps = np.arange(length)
+            while len(todo):
+                m = len(todo)
+                horizontal = self.rng.random(m) < 0.5
+
+                # Top left corner, kept far enough from the edge
+                along = self.rng.integers(0, size - length + 1, m)
+                across = self.rng.integers(0, size, m)
+                x0 = np.where(horizontal, along, across)
+                y0 = np.where(horizontal, across, along)
+
+                xs = x0[:, None] + steps * horizontal[:, None]
+                ys = y0[:, None] + steps * ~horizontal[:, None]
+
+                free = (boards[todo[:, None], ys, xs] < 0).all(axis=1)
+                done = todo[free]
+                boards[done[:, None], ys[free], xs[free]] = i
+                todo = todo[~free]
+
+        return boards
+
+    def step(self, x, y):
+        """Fire one shot in every game and resolve it.
+
+        x and y are arrays of k column and row indices. Returns a tuple
+        of arrays (result, sunk, over) where result is the new state of
+        the shot cell (0 if it was already shot), sunk is the index of
+        the ship sunk by the shot or -1 and over is whether the game
+        ended. Finished games are reset straight away.
+        """
+
+        g = self.games
+
+        fresh = self.shots[g, y, x] == UNKNOWN
+        ship = self.boards[g, y, x]
+        hit = fresh & (ship >= 0)
+
+        result = np.where(hit, HIT, MISS).astype(np.int8)
+        result[~fresh] = UNKNOWN
+        self.shots[g[fresh], y[fresh], x[fresh]] = result[fresh]
+        self.turns += fresh
+
+        # One shot per game, so no repeated indices here
+        hit_games, hit_ships = g[hit], ship[hit]
+        self.ship_hits[hit_games, hit_ships] += 1
+        self.remaining[hit_games] -= 1
+
+        sunk = np.full(self.k, -1, dtype=np.int8)
+        is_sunk = self.ship_hits[hit_games, hit_ships] == self.lengths[hit_ships]
+        sunk[hit_games[is_sunk]] = hit_ships[is_sunk]
+
+        over = self.remaining == 0
+        self.finished_turns = self.turns[over]
+        self.reset(over)
+
+        return result, sunk, over
+
+    def random_shots(self):
+        """Return x and y arrays of a random unshot cell in every game."""
+
+        # Random noise on shot cells is pushed below every unshot cell
+        noise = self.rng.random(self.shots.shape)
+        noise[self.shots != UNKNOWN] = -1
+        flat = noise.reshape(self.k, -1).argmax(axis=1)
+
+        return flat % self.size, flat // self.size
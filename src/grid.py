@@ -1,5 +1,7 @@
 from fltk import *
 
+import sprites
+
 
 class Grid(Fl_Group):
     """Grid of tiles in a battleship game."""
@@ -21,11 +23,20 @@ class Grid(Fl_Group):
         
         # Assumes equal w & h, r & c
         self.dim = round(w / c)
+
+        # Sprites for this grid's tiles, and ships on them
+        self.sprites = sprites.SpriteCache()
         
         self.gentiles()
         
         self.end()
 
+        # Window coordinates of the left/top edges of each column/row
+        self.xs = list()
+        self.ys = list()
+
+        self.layout()
+
     def gentiles(self):
         """Generate self.r * self.c tiles and append lists of rows to self.tiles."""
         
@@ -42,30 +53,60 @@ class Grid(Fl_Group):
             col_list = list()
             for x in range(self.c):
                 x_pos, y_pos = start_x + (self.dim * x), start_y + (self.dim * y)
-                col_list.append(Tile(x_pos, y_pos, self.dim, self.dim, self.gamewin, x, y))
+                tile = Tile(x_pos, y_pos, self.dim, self.dim, self.gamewin, x, y)
+                tile.sprites = self.sprites
+                col_list.append(tile)
 
             self.tiles.append(col_list)
 
         self.end()
 
-    def draw(self):
-        """Resize all tiles according to current size."""
+    def resize(self, x, y, w, h):
+        """Extend Fl_Group resize to lay out tiles for the new size."""
 
-        super().draw()
-        
-        self.dim = self.getdim()
-        start_x, start_y, = self.x(), self.y()
+        super().resize(x, y, w, h)
+        self.layout()
+
+    def layout(self):
+        """Position all tiles according to current size.
+
+        Only needs to happen when the grid is resized, not every draw.
+        """
+
+        # Sprites of the old size won't be needed again
+        dim = self.getdim()
+        if dim != self.dim:
+            self.sprites.clear()
+        self.dim = dim
+
+        self.xs = [self.x() + (self.dim * x) for x in range(self.c)]
+        self.ys = [self.y() + (self.dim * y) for y in range(self.r)]
 
         for y in range(self.r):
             for x in range(self.c):
-                x_pos, y_pos = start_x + (self.dim * x), start_y + (self.dim * y)
-                self.tiles[y][x].resize(x_pos, y_pos, self.dim, self.dim)
+                self.tiles[y][x].resize(self.xs[x], self.ys[y], self.dim, self.dim)
+
+    def tile_at(self, x, y):
+        """Return the tile at window coordinates x, y, or None if outside the grid."""
+
+        if self.dim <= 0:
+            return None
+
+        col = (x - self.xs[0]) // self.dim
+        row = (y - self.ys[0]) // self.dim
+
+        if 0 <= col < self.c and 0 <= row < self.r:
+            return self.tiles[row][col]
+        return None
 
     def update_visuals(self, hit_list):
         """Update hits and misses among tiles according to passed list."""
 
         for y in range(self.r):
             for x in range(self.c):
+                # Chosen salvo shots have been resolved by now
+                self.tiles[y][x].pending = False
+
                 if hit_list[y][x] == 1: # Miss
                     self.tiles[y][x].miss = True
                 elif hit_list[y][x] == 2: # Hit
@@ -75,7 +116,8 @@ class Grid(Fl_Group):
                     self.tiles[y][x].miss = False
                     self.tiles[y][x].hit = False
                 
-        self.redraw()
+        # Whole window so boats get drawn back over the tiles
+        self.gamewin.redraw()
 
     def getdim(self):
         """Get the dimensions of one tile."""
@@ -83,11 +125,10 @@ class Grid(Fl_Group):
 
     def wid_in(self, wid):
         """Return whether passed wid is in self.tiles."""
-        
-        for row in self.tiles:
-            if wid in row:
-                return True
-        return False
+
+        if not isinstance(wid, Tile):
+            return False
+        return self.tiles[wid.y_ind][wid.x_ind] is wid
 
 
 class Tile(Fl_Button):
@@ -115,6 +156,9 @@ class Tile(Fl_Button):
         self.hit = False
         self.miss = False
 
+        # Chosen as part of a salvo that hasn't been fired yet
+        self.pending = False
+
     def handle(self, event):
         """Respond to events and update gamewin if necessary."""
 
@@ -133,11 +177,15 @@ class Tile(Fl_Button):
         return super().handle(event)
 
     def draw(self):
-        """Extend Fl_Button draw to draw hit or miss markers."""
-
-        super().draw()
-
-        if self.hit or self.miss:
-            # Change colour depending on hit or miss
-            fl_color(FL_RED if self.hit else FL_WHITE)
-            fl_pie(self.x()+4, self.y()+4, self.w() - 8, self.h() - 8, 0.0, 360.0)
\ No newline at end of file
+        """Draw the tile and any hit or miss marker from the sprite cache."""
+
+        if self.hit:
+            marker = 'hit'
+        elif self.miss:
+            marker = 'miss'
+        elif self.pending:
+            marker = 'pending'
+        else:
+            marker = None
+
+        self.sprites.blit(('tile', marker), self.x(), self.y(), self.w())
\ No newline at end of file
@@ -0,0 +1,444 @@
+import argparse
+import os
+import pickle
+import selectors
+import signal
+import socket
+import sys
+import time
+import traceback
+
+from protocol import HEARTBEAT_BYTES, HEARTBEAT_INTERVAL, DEADLINE, TimerWheel
+
+# Same as network.Server, so games join a hub like any other host
+PORT = 42069
+
+# Most bytes buffered for a player not reading them, or sent by a player
+# without an opponent yet. Games send a few hundred bytes at a time, and
+# a handoff has to fit in one lobby message.
+MAX_OUTGOING = 256 * 1024
+MAX_PENDING = 16 * 1024
+
+
+def only_heartbeats(data):
+    """Return whether received bytes are nothing but heartbeats.
+
+    A player waiting for an opponent sends nothing else, so their
+    heartbeats always arrive like this. They only show the player is
+    alive, and aren't kept to be sent on to the opponent.
+    """
+    return not data.replace(HEARTBEAT_BYTES, b'')
+
+
+class Worker:
+    """Event loop of one hub process, relaying games between pairs of players.
+
+    Every worker has its own listening socket on the shared port, and
+    the kernel spreads new connections between them. A player is paired
+    with the next one to arrive at the same worker, or handed to the
+    lobby in the parent process if nobody arrives for a moment.
+
+    Players that send nothing for a while, not even a heartbeat, have
+    gone without closing their connection. They're dropped along with
+    their game. Sockets never block, data a player isn't reading yet is
+    buffered, and a player that stops reading altogether is dropped once
+    too much builds up, so one player can't hold up any other game.
+    """
+
+    def __init__(self, listener, lobby, handoff_delay=0.05, deadline=DEADLINE):
+        """Initialize an instance.
+
+        listener is this worker's listening socket and lobby its end of
+        a SOCK_SEQPACKET socketpair with the parent. Players are handed
+        to the lobby after waiting handoff_delay seconds unpaired, and
+        dropped after deadline seconds without sending anything.
+        """
+
+        self.listener = listener
+        self.lobby = lobby
+        self.handoff_delay = handoff_delay
+
+        # Every player's connection, by when it was last heard from
+        self.wheel = TimerWheel(deadline, HEARTBEAT_INTERVAL)
+
+        self.sel = selectors.DefaultSelector()
+        self.sel.register(self.listener, selectors.EVENT_READ, self.accept)
+        self.sel.register(self.lobby, selectors.EVENT_READ, self.recv_lobby)
+
+        # Game table, each player's socket to their opponent's
+        self.peers = dict()
+
+        # Bytes sent by players without an opponent yet
+        self.pending = dict()
+
+        # Bytes waiting to be sent to each player
+        self.outgoing = dict()
+
+        # Player without an opponent and when they arrived
+        self.waiting = None
+
+    def run(self):
+        """Serve players forever."""
+
+        while True:
+            timeout = self.wheel.until_tick()
+            if self.waiting is not None:
+                timeout = min(timeout, max(0, self.waiting[1] + self.handoff_delay - time.monotonic()))
+
+            for key, mask in self.sel.select(timeout):
+                try:
+                    if mask & selectors.EVENT_WRITE:
+                        self.flush(key.fileobj)
+                    if mask & selectors.EVENT_READ:
+                        key.data(key.fileobj)
+
+                # One bad connection mustn't end every game on the worker
+                except Exception:
+                    traceback.print_exc()
+                    if key.fileobj in self.outgoing:
+                        self.drop(key.fileobj)
+
+            if self.wheel.until_tick() == 0:
+                self.heartbeat()
+
+            if self.waiting is not None and time.monotonic() >= self.waiting[1] + self.handoff_delay:
+                self.handoff(self.waiting[0])
+                self.waiting = None
+
+    def accept(self, listener):
+        """Accept every waiting connection and pair them up."""
+
+        while True:
+            try:
+                conn, raddr = listener.accept()
+            except BlockingIOError:
+                break
+            self.arrive(conn, b'')
+
+    def add(self, conn, pending):
+        """Start serving a player's connection."""
+
+        conn.setblocking(False)
+        self.pending[conn] = pending
+        self.outgoing[conn] = bytearray()
+        self.sel.register(conn, selectors.EVENT_READ, self.recv_player)
+        self.wheel.add(conn)
+
+    def arrive(self, conn, pending):
+        """Pair a new player, or keep them waiting."""
+
+        self.add(conn, pending)
+
+        if self.waiting is None:
+            self.waiting = (conn, time.monotonic())
+        else:
+            other = self.waiting[0]
+            self.waiting = None
+            self.pair(other, conn)
+
+    def handoff(self, conn):
+        """Give an unpaired player to the lobby to find an opponent elsewhere."""
+
+        # Can't hand over a partly sent message
+        if self.outgoing[conn]:
+            self.drop(conn)
+            return
+
+        self.sel.unregister(conn)
+        self.wheel.remove(conn)
+        del self.outgoing[conn]
+        pending = self.pending.pop(conn)
+
+        # Never an empty message, that would look like the lobby closing
+        socket.send_fds(self.lobby, [b'P' + pending], [conn.fileno()])
+        conn.close()
+
+    def recv_lobby(self, lobby):
+        """Take a pair of players matched by the lobby."""
+
+        data, fds, flags, addr = socket.recv_fds(lobby, 65536, 2)
+        if not data: # Parent has gone
+            raise SystemExit
+
+        pending = pickle.loads(data)
+        conns = [socket.socket(fileno=fd) for fd in fds]
+        for conn, buf in zip(conns, pending):
+            self.add(conn, buf)
+
+        self.pair(*conns)
+
+    def pair(self, first, second):
+        """Start a game between two players, first goes first."""
+
+        self.peers[first] = second
+        self.peers[second] = first
+
+        # Rules come before anything the opponent has already sent
+        data = [pickle.dumps(('rules', {'first': goes_first})) for goes_first in (True, False)]
+        data[0] += self.pending.pop(second)
+        data[1] += self.pending.pop(first)
+
+        # Either can have gone already, which drops the other too
+        self.send(first, data[0])
+        if second in self.peers:
+            self.send(second, data[1])
+
+    def send(self, conn, data):
+        """Send as much of data to a player as possible, and buffer the rest.
+
+        The player, and their game, are dropped if they've gone or if
+        they've stopped reading.
+        """
+
+        buf = self.outgoing[conn]
+        if not buf:
+            try:
+                sent = conn.send(data)
+            except BlockingIOError:
+                sent = 0
+            except OSError:
+                self.drop(conn)
+                return
+            data = data[sent:]
+            if not data:
+                return
+
+            # Finish when the player catches up
+            self.sel.modify(conn, selectors.EVENT_READ | selectors.EVENT_WRITE, self.recv_player)
+
+        buf += data
+        if len(buf) > MAX_OUTGOING:
+            self.drop(conn)
+
+    def flush(self, conn):
+        """Send buffered data to a player that can take more."""
+
+        # Dropped earlier in this select
+        if conn not in self.outgoing:
+            return
+
+        buf = self.outgoing[conn]
+        try:
+            sent = conn.send(buf)
+        except BlockingIOError:
+            return
+        except OSError:
+            self.drop(conn)
+            return
+
+        del buf[:sent]
+        if not buf:
+            self.sel.modify(conn, selectors.EVENT_READ, self.recv_player)
+
+    def recv_player(self, conn):
+        """Relay data from a player to their opponent."""
+
+        # Dropped along with their opponent earlier in this select
+        if conn not in self.outgoing:
+            return
+
+        try:
+            data = conn.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+
+        if not data:
+            self.drop(conn)
+            return
+
+        self.wheel.touch(conn)
+        if conn in self.peers:
+            self.send(self.peers[conn], data)
+        elif not only_heartbeats(data): # Forwarded once they're paired
+            self.pending[conn] += data
+            if len(self.pending[conn]) > MAX_PENDING:
+                self.drop(conn)
+
+    def drop(self, conn):
+        """Close a player's connection, and end their game if they had one."""
+
+        other = self.peers.pop(conn, None)
+        for c in (conn, other):
+            if c is None or c not in self.outgoing:
+                continue
+            self.peers.pop(c, None)
+            self.pending.pop(c, None)
+            del self.outgoing[c]
+            self.wheel.remove(c)
+            self.sel.unregister(c)
+            c.close()
+
+        if self.waiting is not None and self.waiting[0] is conn:
+            self.waiting = None
+
+    def heartbeat(self):
+        """Drop players gone silent, and keep unpaired players' connections alive.
+
+        Paired players get their opponent's heartbeats relayed instead.
+        """
+
+        for conn in self.wheel.advance():
+            self.drop(conn)
+
+        for conn in list(self.pending):
+            if conn in self.outgoing:
+                self.send(conn, HEARTBEAT_BYTES)
+
+
+def lobby(channels, deadline=DEADLINE):
+    """Match players handed off by workers, forever.
+
+    channels is a list of the parent's ends of each worker's socketpair.
+    A matched pair goes to the worker that sent the second player. The
+    waiting player is looked after here until then, and dropped after
+    deadline seconds without sending anything.
+    """
+
+    sel = selectors.DefaultSelector()
+    for channel in channels:
+        sel.register(channel, selectors.EVENT_READ, 'worker')
+
+    # (socket, pending bytes, when last heard from) of a player waiting for an opponent
+    waiting = None
+    last_beat = time.monotonic()
+
+    while True:
+        for key, mask in sel.select(HEARTBEAT_INTERVAL):
+            if key.data == 'player':
+                # Matched earlier in this select
+                if waiting is None or key.fileobj is not waiting[0]:
+                    continue
+
+                conn = waiting[0]
+                try:
+                    data = conn.recv(65536)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    data = b''
+
+                if data and only_heartbeats(data):
+                    waiting = (conn, waiting[1], time.monotonic())
+                elif data and len(waiting[1]) + len(data) <= MAX_PENDING:
+                    waiting = (conn, waiting[1] + data, time.monotonic())
+                else:
+                    sel.unregister(conn)
+                    conn.close()
+                    waiting = None
+                continue
+
+            channel = key.fileobj
+            data, fds, flags, addr = socket.recv_fds(channel, 65536, 1)
+            if not data: # Worker has gone
+                sel.unregister(channel)
+                continue
+            data = data[1:]
+
+            if waiting is None:
+                conn = socket.socket(fileno=fds[0])
+                conn.setblocking(False)
+                sel.register(conn, selectors.EVENT_READ, 'player')
+                waiting = (conn, data, time.monotonic())
+            else:
+                conn = waiting[0]
+                sel.unregister(conn)
+                pending = pickle.dumps((waiting[1], data))
+                socket.send_fds(channel, [pending], [conn.fileno(), fds[0]])
+                conn.close()
+                os.close(fds[0])
+                waiting = None
+
+        if waiting is None:
+            continue
+
+        # Their worker has let go of the waiting player, so heartbeats come from here
+        now = time.monotonic()
+        gone = now - waiting[2] >= deadline
+        if not gone and now - last_beat >= HEARTBEAT_INTERVAL:
+            last_beat = now
+
+            # Not taking a whole heartbeat means they've stopped reading,
+            # and the rest of it can't be sent later without blocking
+            try:
+                gone = waiting[0].send(HEARTBEAT_BYTES) < len(HEARTBEAT_BYTES)
+            except OSError:
+                gone = True
+
+        if gone:
+            sel.unregister(waiting[0])
+            waiting[0].close()
+            waiting = None
+
+
+def listen(host, port):
+    """Return a listening socket sharing its port with the other workers."""
+
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    s.bind((host, port))
+    s.listen(128)
+    s.setblocking(False)
+    return s
+
+
+def serve(host='0.0.0.0', port=PORT, workers=os.cpu_count(), handoff_delay=0.05, deadline=DEADLINE):
+    """Fork worker processes sharing port, and run the lobby in this one."""
+
+    channels = list()
+    pids = list()
+
+    for i in range(workers):
+        parent_end, child_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+
+        pid = os.fork()
+        if pid == 0: # Worker
+            parent_end.close()
+            for channel in channels:
+                channel.close()
+
+            # Each worker needs its own socket for the kernel to balance
+            try:
+                Worker(listen(host, port), child_end, handoff_delay, deadline).run()
+            except KeyboardInterrupt:
+                pass
+            os._exit(0)
+
+        child_end.close()
+        channels.append(parent_end)
+        pids.append(pid)
+
+    # Stop the workers too when told to stop
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        lobby(channels, deadline)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in pids:
+            os.waitpid(pid, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Host many battleship games at once.')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of worker processes (default: number of cores)')
+    parser.add_argument('--handoff-delay', type=float, default=0.05,
+                        help='seconds a player waits for an opponent on the same worker')
+    parser.add_argument('--deadline', type=float, default=DEADLINE,
+                        help='seconds without hearing from a player before dropping them')
+    args = parser.parse_args()
+
+    serve(args.host, args.port, args.workers, args.handoff_delay, args.deadline)
+
+if __name__ == '__main__':
+    main()
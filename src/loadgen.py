@@ -0,0 +1,473 @@
+import argparse
+import heapq
+import os
+import pickle
+import random
+import selectors
+import socket
+import subprocess
+import sys
+import time
+
+from protocol import FLEET, HEARTBEAT, HEARTBEAT_BYTES, HEARTBEAT_INTERVAL, HIT, MISS, unpack
+
+
+def random_fleet(rng, size=10):
+    """Return a random valid fleet like BattleWin.all_placed sends."""
+
+    used = set()
+    boats = list()
+    for length in FLEET:
+        while True:
+            horizontal = rng.random() < 0.5
+            x = rng.randrange(size - length + 1 if horizontal else size)
+            y = rng.randrange(size if horizontal else size - length + 1)
+            cells = {(x+i, y) if horizontal else (x, y+i) for i in range(length)}
+            if not cells & used:
+                break
+        used |= cells
+        boats.append((length, x, y, horizontal))
+
+    return boats, used
+
+
+def fleet_cells(boats):
+    """Return the set of tiles covered by (length, x, y, horizontal) boats."""
+    return {(x+i, y) if h else (x, y+i) for length, x, y, h in boats for i in range(length)}
+
+
+class Player:
+    """A simulated BattleWin that plays whole games against whoever it's paired with.
+
+    Sends the same messages in the same order as a real game: username,
+    fleet, then the full hit grid after every shot, and heartbeats in
+    between like network.Heartbeats so the host doesn't drop it while
+    thinking.
+    """
+
+    def __init__(self, gen, index):
+        """Initialize an instance.
+
+        gen is the LoadGen running the player, index is its number.
+        """
+
+        self.gen = gen
+        self.index = index
+        self.name = f'load{index}'
+        self.sock = None
+
+    def connect(self):
+        """Start connecting for a new game."""
+
+        self.buffer = b''
+        self.outgoing = bytearray()
+        self.connecting = True
+        self.first = False
+        self.enemy_cells = None
+        self.turn = False
+        self.sent_at = None
+
+        self.fleet, self.cells = random_fleet(self.gen.rng)
+        self.hit_list = [[0] * 10 for i in range(10)]
+        self.e_hit_list = [[0] * 10 for i in range(10)]
+        self.unshot = [(x, y) for y in range(10) for x in range(10)]
+        self.gen.rng.shuffle(self.unshot)
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setblocking(False)
+        self.started = time.perf_counter()
+        self.sock.connect_ex(self.gen.address)
+        self.gen.sel.register(self.sock, selectors.EVENT_WRITE, self)
+
+    def writable(self):
+        """Finish connecting, or send buffered data now the host can take more."""
+
+        if self.connecting:
+            self.connected()
+        else:
+            self.flush()
+
+    def connected(self):
+        """Send username and fleet once connected."""
+
+        err = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            self.gen.errors += 1
+            self.close()
+            return
+
+        self.connecting = False
+        self.gen.connect_times.append(time.perf_counter() - self.started)
+        self.gen.sel.modify(self.sock, selectors.EVENT_READ, self)
+
+        self.send_data(self.name)
+        if self.sock is not None:
+            self.send_data(self.fleet)
+        if self.sock is not None:
+            self.gen.schedule(HEARTBEAT_INTERVAL, self.heartbeat, self.sock)
+
+    def send_data(self, data):
+        """Send passed data to the host."""
+
+        self.send(pickle.dumps(data))
+        if self.sock is not None:
+            self.gen.sent += 1
+
+    def heartbeat(self):
+        """Send a heartbeat, they aren't counted as messages."""
+
+        self.send(HEARTBEAT_BYTES)
+        if self.sock is not None:
+            self.gen.schedule(HEARTBEAT_INTERVAL, self.heartbeat, self.sock)
+
+    def send(self, data):
+        """Send as much of data as possible and buffer the rest, like hub.Worker.send.
+
+        A slow host then only holds up this player rather than every
+        player on the event loop. The connection is closed if it's gone.
+        """
+
+        if not self.outgoing:
+            try:
+                sent = self.sock.send(data)
+            except BlockingIOError:
+                sent = 0
+            except OSError:
+                self.gen.errors += 1
+                self.close()
+                return
+            data = data[sent:]
+            if not data:
+                return
+
+            # Finish when the host catches up
+            self.gen.sel.modify(self.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, self)
+
+        self.outgoing += data
+
+    def flush(self):
+        """Send buffered data to a host that can take more."""
+
+        try:
+            sent = self.sock.send(self.outgoing)
+        except BlockingIOError:
+            return
+        except OSError:
+            self.gen.errors += 1
+            self.close()
+            return
+
+        del self.outgoing[:sent]
+        if not self.outgoing:
+            self.gen.sel.modify(self.sock, selectors.EVENT_READ, self)
+
+    def receive_data(self):
+        """Receive data from the host and act on every complete message."""
+
+        try:
+            data = self.sock.recv(65536)
+        except BlockingIOError:
+            return
+        except ConnectionError:
+            data = b''
+
+        # Players close their own connection once a game is over
+        if data == b'':
+            self.gen.errors += 1
+            self.close()
+            return
+
+        messages, self.buffer = unpack(self.buffer + data)
+        for msg in messages:
+            if msg == HEARTBEAT:
+                continue
+            self.gen.received += 1
+            self.recv_data(msg)
+            if self.sock is None: # Game ended part way through
+                return
+
+    def recv_data(self, data):
+        """Respond to one message, like BattleWin.recv_data."""
+
+        # Opponent's username
+        if isinstance(data, str):
+            self.gen.pair_times.append(time.perf_counter() - self.started)
+
+        elif isinstance(data, tuple):
+            if data[0] == 'rules':
+                self.first = data[1].get('first', False)
+
+        # Enemy fleet
+        elif self.enemy_cells is None:
+            self.enemy_cells = fleet_cells(data)
+            if self.first:
+                self.start_turn()
+
+        else: # Opponent's shot
+            # From our shot to their reply, less the time they spent thinking,
+            # so it works whichever process the opponent is in
+            if self.sent_at is not None:
+                self.gen.latencies.append(time.perf_counter() - self.sent_at - self.gen.think)
+                self.sent_at = None
+
+            self.hit_list = data
+            hits = sum(1 for x, y in self.cells if data[y][x] == HIT)
+            if hits == len(self.cells): # Lost
+                self.finish()
+            else:
+                self.start_turn()
+
+    def start_turn(self):
+        """Shoot after thinking for a while."""
+        self.gen.schedule(self.gen.think, self.shoot, self.sock)
+
+    def shoot(self):
+        """Shoot a random unshot tile and send the whole grid."""
+
+        x, y = self.unshot.pop()
+        self.e_hit_list[y][x] = HIT if (x, y) in self.enemy_cells else MISS
+
+        self.sent_at = time.perf_counter()
+        self.send_data(self.e_hit_list)
+        if self.sock is None:
+            return
+
+        hits = sum(1 for x, y in self.enemy_cells if self.e_hit_list[y][x] == HIT)
+        if hits == len(self.enemy_cells): # Won
+            self.gen.games += 1
+            self.finish()
+
+    def finish(self):
+        """Disconnect after a game, and start another if there's time."""
+
+        self.close()
+        if self.gen.running():
+            self.connect()
+
+    def close(self):
+        """Close the connection."""
+
+        if self.sock is not None:
+            self.gen.sel.unregister(self.sock)
+            self.sock.close()
+            self.sock = None
+
+
+class LoadGen:
+    """Runs many simulated players against a host, all on one event loop."""
+
+    def __init__(self, address, players, think=0.0, duration=10.0, first_index=0, seed=None):
+        """Initialize an instance.
+
+        address is the (host, port) to connect to, players the number of
+        simulated players, think the seconds each takes per shot and
+        duration how long to keep starting new games.
+        """
+
+        self.address = address
+        self.think = think
+        self.duration = duration
+        self.rng = random.Random(seed)
+
+        self.sel = selectors.DefaultSelector()
+
+        # (time, count, callback, sock) heap of delayed shots and heartbeats
+        self.timers = list()
+        self.timer_count = 0
+
+        self.players = {
+            f'load{i}': Player(self, i) for i in range(first_index, first_index + players)
+        }
+
+        self.connect_times = list()
+        self.pair_times = list()
+        self.latencies = list()
+        self.sent = 0
+        self.received = 0
+        self.games = 0
+        self.errors = 0
+
+    def schedule(self, delay, callback, sock):
+        """Call callback after delay seconds, unless sock has been closed by then."""
+
+        self.timer_count += 1
+        heapq.heappush(self.timers, (time.perf_counter() + delay, self.timer_count, callback, sock))
+
+    def running(self):
+        """Return whether new games should still be started."""
+        return time.perf_counter() < self.end
+
+    def run(self):
+        """Play games for duration seconds, return a dict of results."""
+
+        start = time.perf_counter()
+        self.end = start + self.duration
+
+        for player in self.players.values():
+            player.connect()
+
+        # Let games in progress finish, but not forever
+        while time.perf_counter() < self.end + 10 + self.think * 100:
+            # Timers left over are only for closed connections
+            if not self.sel.get_map():
+                break
+
+            timeout = 0.1
+            if self.timers:
+                timeout = max(0, min(timeout, self.timers[0][0] - time.perf_counter()))
+
+            for key, mask in self.sel.select(timeout):
+                player = key.data
+                if mask & selectors.EVENT_WRITE and player.sock is key.fileobj:
+                    player.writable()
+                # Closed, or started another game, earlier in this select
+                if mask & selectors.EVENT_READ and player.sock is key.fileobj:
+                    player.receive_data()
+
+            # Nobody new is coming to pair with players still waiting
+            if not self.running():
+                for player in self.players.values():
+                    if player.sock is not None and player.enemy_cells is None:
+                        player.close()
+
+            now = time.perf_counter()
+            while self.timers and self.timers[0][0] <= now:
+                when, count, callback, sock = heapq.heappop(self.timers)
+                if callback.__self__.sock is sock: # Still the same game
+                    callback()
+
+        return {
+            'elapsed': time.perf_counter() - start,
+            'connect_times': self.connect_times,
+            'pair_times': self.pair_times,
+            'latencies': self.latencies,
+            'sent': self.sent,
+            'received': self.received,
+            'games': self.games,
+            'errors': self.errors,
+        }
+
+
+def rss(pid):
+    """Return resident memory of a process and all its children, in bytes."""
+
+    total = 0
+    pids = [pid]
+    while pids:
+        p = pids.pop()
+        try:
+            with open(f'/proc/{p}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+            with open(f'/proc/{p}/task/{p}/children') as f:
+                pids.extend(int(c) for c in f.read().split())
+        except FileNotFoundError:
+            pass
+    return total
+
+
+def percentiles(values, ps=(50, 90, 99)):
+    """Return a string of passed percentiles of values in milliseconds."""
+
+    if not values:
+        return 'n/a'
+    values = sorted(values)
+    parts = [f'p{p} {values[min(len(values) - 1, len(values) * p // 100)] * 1000:.2f}' for p in ps]
+    return ', '.join(parts) + ' ms'
+
+
+def worker(address, players, think, duration, first_index, seed, conn):
+    """Run a LoadGen in a child process and send back its results."""
+
+    results = LoadGen(address, players, think, duration, first_index, seed).run()
+    conn.sendall(pickle.dumps(results))
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Play many simulated games against a battleship host.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=42069)
+    parser.add_argument('--players', type=int, default=100,
+                        help='number of concurrent simulated players (default: 100)')
+    parser.add_argument('--think', type=float, default=0.0,
+                        help='seconds each player takes per shot (default: 0)')
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='seconds to keep starting new games (default: 10)')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='load generator processes to split the players over (default: 1)')
+    parser.add_argument('--spawn-hub', type=int, metavar='WORKERS', default=0,
+                        help='start a hub with this many workers to test against')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    address = (args.host, args.port)
+
+    hub = None
+    if args.spawn_hub:
+        hub_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hub.py')
+        hub = subprocess.Popen([sys.executable, hub_path, '--host', args.host,
+                                '--port', str(args.port), '--workers', str(args.spawn_hub)])
+        time.sleep(1)
+        base_rss = rss(hub.pid)
+
+    try:
+        # Each process gets its own share of players and its own event loop
+        children = list()
+        per_process = args.players // args.processes
+        for i in range(args.processes):
+            parent_end, child_end = socket.socketpair()
+            seed = None if args.seed is None else args.seed + i
+            pid = os.fork()
+            if pid == 0:
+                parent_end.close()
+                worker(address, per_process, args.think, args.duration, i * per_process, seed, child_end)
+                os._exit(0)
+            child_end.close()
+            children.append((pid, parent_end))
+
+        # Sample host memory while every player is in a game
+        peak_rss = None
+        if hub is not None:
+            time.sleep(min(args.duration / 2, 2 + args.think * 10))
+            peak_rss = rss(hub.pid)
+
+        results = list()
+        for pid, conn in children:
+            data = b''
+            while True:
+                chunk = conn.recv(1 << 20)
+                if not chunk:
+                    break
+                data += chunk
+            results.append(pickle.loads(data))
+            os.waitpid(pid, 0)
+    finally:
+        if hub is not None:
+            hub.terminate()
+            hub.wait()
+
+    elapsed = max(r['elapsed'] for r in results)
+    combined = {key: [v for r in results for v in r[key]]
+                for key in ('connect_times', 'pair_times', 'latencies')}
+    sent = sum(r['sent'] for r in results)
+    received = sum(r['received'] for r in results)
+    games = sum(r['games'] for r in results)
+    errors = sum(r['errors'] for r in results)
+
+    print(f'players:          {per_process * args.processes} in {args.processes} process(es), think {args.think}s')
+    print(f'games:            {games} in {elapsed:.1f}s, {games / elapsed:.1f} games/s')
+    print(f'messages:         {(sent + received) / elapsed:.0f}/s ({sent} sent, {received} received)')
+    print(f'connect:          {percentiles(combined["connect_times"])}')
+    print(f'paired:           {percentiles(combined["pair_times"])}')
+    print(f'turn latency:     {percentiles(combined["latencies"])}')
+    if peak_rss is not None:
+        per_game = (peak_rss - base_rss) / max(1, per_process * args.processes // 2)
+        print(f'host memory:      {base_rss / 2**20:.1f} MiB idle, {peak_rss / 2**20:.1f} MiB loaded, '
+              f'{per_game / 1024:.1f} KiB per game')
+    if errors:
+        print(f'connection errors: {errors}')
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,64 @@ from fltk import *
 import pickle
 import socket
 
+from protocol import HEARTBEAT, HEARTBEAT_BYTES, HEARTBEAT_INTERVAL, DEADLINE, TimerWheel, unpack
+
+
+class Heartbeats:
+    """Keeps every connection in this process alive, and notices dead ones.
+
+    A heartbeat is sent on each connection every interval, and a
+    connection that hasn't received anything for deadline seconds is
+    reported to its game like a closed one. A connection can stay open
+    when the other end has vanished, so this is the only way to find out.
+    One timeout drives all connections.
+    """
+
+    def __init__(self, interval=HEARTBEAT_INTERVAL, deadline=DEADLINE):
+        """Initialize an instance."""
+
+        self.interval = interval
+        self.conns = set()
+        self.wheel = TimerWheel(deadline, interval)
+
+    def add(self, conn):
+        """Start sending heartbeats on a Server or Client and watching it."""
+
+        if not self.conns:
+            Fl.add_timeout(self.interval, self.tick)
+        self.conns.add(conn)
+        self.wheel.add(conn)
+
+    def touch(self, conn):
+        """Record that data has been received on a connection."""
+        self.wheel.touch(conn)
+
+    def remove(self, conn):
+        """Stop sending heartbeats on a connection and watching it."""
+
+        self.conns.discard(conn)
+        self.wheel.remove(conn)
+        if not self.conns:
+            Fl.remove_timeout(self.tick)
+
+    def tick(self):
+        """Send heartbeats and report connections gone silent."""
+
+        for conn in list(self.conns):
+            conn.send_heartbeat()
+
+        for conn in self.wheel.advance():
+            self.conns.discard(conn)
+            conn.gamewin.disconn_cb(0)
+
+        if self.conns:
+            Fl.repeat_timeout(self.interval, self.tick)
+
+
+# Shared by every connection, replace to change the interval or deadline
+heartbeats = Heartbeats()
+
+
 class Server:
     """TCP server to host a game, send and receive data between
     two games."""
@@ -15,6 +73,7 @@ class Server:
 
         self.gamewin = gamewin
         self.conn = None
+        self.buffer = b''
 
         self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.s.bind((host, port))
@@ -27,9 +86,11 @@ class Server:
         """Accept a connection."""
 
         self.conn, raddr = self.s.accept()
+        self.buffer = b''
         self.fd = self.conn.fileno()
 
         Fl.add_fd(self.fd, self.receive_data)
+        heartbeats.add(self)
 
         self.gamewin.connected_cb()
 
@@ -44,11 +105,27 @@ class Server:
             self.conn = None
         
         else: # Send to gamewin
-            self.gamewin.recv_data(pickle.loads(data))
+            heartbeats.touch(self)
+            messages, self.buffer = unpack(self.buffer + data)
+            for msg in messages:
+                if msg != HEARTBEAT:
+                    self.gamewin.recv_data(msg)
+
+                # Game disconnected part way through, e.g. a bad fleet
+                if self.gamewin.connection is not self:
+                    break
     
     def send_data(self, data):
         """Send passed data to connection."""
         self.conn.sendall(pickle.dumps(data))
+
+    def send_heartbeat(self):
+        """Let the connected game know this one is still there."""
+
+        try:
+            self.conn.sendall(HEARTBEAT_BYTES)
+        except OSError: # Noticed when the deadline passes
+            pass
     
     def close(self):
         """Close the connection.
@@ -57,6 +134,7 @@ class Server:
         of experimentation to not get errors.
         """
 
+        heartbeats.remove(self)
         try:
             self.s.close()
         except Exception as e:
@@ -78,12 +156,14 @@ class Client:
         """
 
         self.gamewin = gamewin
+        self.buffer = b''
 
         self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.s.connect((host, port))
         self.fd = self.s.fileno()
 
         Fl.add_fd(self.fd, self.receive_data)
+        heartbeats.add(self)
 
     def receive_data(self, fd):
         """Receive data from connection."""
@@ -95,11 +175,27 @@ class Client:
             self.gamewin.disconn_cb(0)
         
         else: # Send to gamewin
-            self.gamewin.recv_data(pickle.loads(data))
+            heartbeats.touch(self)
+            messages, self.buffer = unpack(self.buffer + data)
+            for msg in messages:
+                if msg != HEARTBEAT:
+                    self.gamewin.recv_data(msg)
+
+                # Game disconnected part way through, e.g. a bad fleet
+                if self.gamewin.connection is not self:
+                    break
     
     def send_data(self, data):
         """Send passed data to connection."""
         self.s.sendall(pickle.dumps(data))
+
+    def send_heartbeat(self):
+        """Let the connected game know this one is still there."""
+
+        try:
+            self.s.sendall(HEARTBEAT_BYTES)
+        except OSError: # Noticed when the deadline passes
+            pass
     
     def close(self):
         """Close the connection.
@@ -108,9 +204,75 @@ class Client:
         of experimentation to not get errors.
         """
 
+        heartbeats.remove(self)
         try:
             self.s.close()
             Fl.remove_fd(self.fd)
         except Exception:
             print('closing without a connection')
-        
\ No newline at end of file
+        
+
+class LocalServer(Server):
+    """Server end of a connection between two games in one process.
+
+    Uses one end of a socketpair instead of a TCP listening socket, so
+    there's no port to bind and no TCP stack in between.
+    """
+
+    def __init__(self, gamewin, sock):
+        """Initialize an instance.
+        
+        gamewin is a BattleWin window, sock is one end of a socketpair.
+        """
+
+        self.gamewin = gamewin
+        self.buffer = b''
+
+        self.conn = sock
+        self.fd = self.conn.fileno()
+
+        Fl.add_fd(self.fd, self.receive_data)
+
+        # Already "accepted", but wait until the other end is set up
+        Fl.add_timeout(0, self.connected)
+        heartbeats.add(self)
+
+    def connected(self):
+        """Tell gamewin the connection is ready, like accept_connections."""
+        self.gamewin.connected_cb()
+
+    def close(self):
+        """Close the connection."""
+
+        heartbeats.remove(self)
+        Fl.remove_timeout(self.connected)
+        if self.conn is not None:
+            self.conn.close()
+            Fl.remove_fd(self.fd)
+            self.conn = None
+
+
+class LocalClient(Client):
+    """Client end of a connection between two games in one process."""
+
+    def __init__(self, gamewin, sock):
+        """Initialize an instance.
+        
+        gamewin is a BattleWin window, sock is one end of a socketpair.
+        """
+
+        self.gamewin = gamewin
+        self.buffer = b''
+
+        self.s = sock
+        self.fd = self.s.fileno()
+
+        Fl.add_fd(self.fd, self.receive_data)
+        heartbeats.add(self)
+
+
+def local_pair(host_gamewin, client_gamewin):
+    """Connect two games in this process, return (LocalServer, LocalClient)."""
+
+    host_sock, client_sock = socket.socketpair()
+    return LocalServer(host_gamewin, host_sock), LocalClient(client_gamewin, client_sock)
@@ -0,0 +1,212 @@
+from fltk import *
+
+import cProfile
+import time
+
+
+class PerfMonitor:
+    """Live overlay of draw timings, callback rates and event loop latency.
+
+    Methods are only wrapped with timers while the overlay is shown, so
+    there is no overhead at all when it's off. The wrappers go on the
+    classes, so they're shared by every window's monitor, installed by
+    the first one enabled and removed by the last one disabled.
+    """
+
+    # Seconds between event loop latency samples
+    interval = 0.1
+
+    # (class, name): original function, or None if it was inherited
+    originals = dict()
+
+    # Totals since the wrappers were installed, wrappers hold on to these
+    draw_time = dict()
+    draw_count = dict()
+    calls = dict()
+
+    # Monitors with the overlay shown
+    active = set()
+
+    def __init__(self, gamewin, draws, callbacks):
+        """Initialize an instance.
+
+        gamewin is a BattleWin window, draws is a list of widget classes
+        to time the draw method of and callbacks a list of (class, method
+        name) tuples to count calls of.
+        """
+
+        self.gamewin = gamewin
+        self.draws = draws
+        self.callbacks = callbacks
+
+        self.enabled = False
+        self.profiler = None
+
+        self.reset_stats()
+
+        gamewin.begin()
+        self.box = Fl_Box(gamewin.w() - 250, 35, 240, 200)
+        self.box.box(FL_BORDER_BOX)
+        self.box.color(FL_WHITE)
+        self.box.labelfont(FL_COURIER)
+        self.box.labelsize(11)
+        self.box.align(FL_ALIGN_INSIDE | FL_ALIGN_TOP | FL_ALIGN_LEFT)
+        self.box.hide()
+        gamewin.end()
+
+    def reset_stats(self):
+        """Start collecting a new second of stats."""
+
+        # Totals at the start, stats are the difference from these
+        self.start_time = dict(self.draw_time)
+        self.start_count = dict(self.draw_count)
+        self.start_calls = dict(self.calls)
+        self.max_latency = 0.0
+        self.ticks = 0
+
+    def wrap(self, cls, name, wrapper):
+        """Replace cls.name with wrapper(original), remembering the original."""
+
+        # Wrapping a wrapper could never be undone
+        if (cls, name) in self.originals:
+            return
+
+        self.originals[(cls, name)] = cls.__dict__.get(name)
+        setattr(cls, name, wrapper(getattr(cls, name)))
+
+    def timed(self, key):
+        """Return a wrapper that adds the time of each call to key's stats."""
+
+        def wrapper(func):
+            clock = time.perf_counter
+            draw_time, draw_count = self.draw_time, self.draw_count
+
+            def timed_func(*args):
+                start = clock()
+                try:
+                    return func(*args)
+                finally:
+                    draw_time[key] = draw_time.get(key, 0.0) + clock() - start
+                    draw_count[key] = draw_count.get(key, 0) + 1
+
+            return timed_func
+        return wrapper
+
+    def counted(self, key):
+        """Return a wrapper that counts calls under key."""
+
+        def wrapper(func):
+            calls = self.calls
+
+            def counted_func(*args, **kwargs):
+                calls[key] = calls.get(key, 0) + 1
+                return func(*args, **kwargs)
+
+            return counted_func
+        return wrapper
+
+    def enable(self):
+        """Start timing and show the overlay."""
+
+        if self.enabled:
+            return
+        self.enabled = True
+
+        # Another window's monitor may have wrapped everything already
+        if not self.active:
+            self.draw_time.clear()
+            self.draw_count.clear()
+            self.calls.clear()
+            for cls in self.draws:
+                self.wrap(cls, 'draw', self.timed(cls.__name__))
+            for cls, name in self.callbacks:
+                self.wrap(cls, name, self.counted(name))
+        self.active.add(self)
+
+        self.reset_stats()
+
+        self.expected = time.perf_counter() + self.interval
+        Fl.add_timeout(self.interval, self.tick)
+
+        self.box.label('Collecting...')
+        self.box.show()
+
+    def disable(self):
+        """Stop timing, put back original methods and hide the overlay."""
+
+        if not self.enabled:
+            return
+        self.enabled = False
+
+        Fl.remove_timeout(self.tick)
+
+        # Leave the wrappers to any other window still using them
+        self.active.discard(self)
+        if not self.active:
+            for (cls, name), original in self.originals.items():
+                if original is None:
+                    delattr(cls, name)
+                else:
+                    setattr(cls, name, original)
+            self.originals.clear()
+
+        self.box.hide()
+
+    def tick(self):
+        """Sample event loop latency, and update the overlay every second."""
+
+        now = time.perf_counter()
+        self.max_latency = max(self.max_latency, now - self.expected)
+        self.expected += self.interval
+        self.ticks += 1
+
+        if self.ticks * self.interval >= 1:
+            self.update(self.ticks * self.interval)
+
+        Fl.repeat_timeout(self.interval, self.tick)
+
+    def update(self, elapsed):
+        """Show the stats collected over elapsed seconds and start again."""
+
+        def since_start(totals, start, key):
+            return totals.get(key, 0) - start.get(key, 0)
+
+        # Window draws are frames
+        frames = since_start(self.draw_count, self.start_count, self.gamewin.__class__.__name__)
+
+        lines = [f'FPS {frames / elapsed:6.1f}', 'Draw ms/s (calls/s)']
+        for cls in self.draws:
+            key = cls.__name__
+            ms = since_start(self.draw_time, self.start_time, key) * 1000 / elapsed
+            count = since_start(self.draw_count, self.start_count, key) / elapsed
+            lines.append(f' {key:<12}{ms:7.2f} ({count:.0f})')
+
+        lines.append('Callbacks/s')
+        for cls, name in self.callbacks:
+            calls = since_start(self.calls, self.start_calls, name)
+            lines.append(f' {name:<16}{calls / elapsed:5.0f}')
+
+        lines.append(f'Loop latency {self.max_latency * 1000:.1f} ms max')
+
+        self.reset_stats()
+
+        # Keep in the top right corner of the window
+        self.box.resize(self.gamewin.w() - 250, 35, 240, 200)
+        self.box.label('\n'.join(lines))
+        self.box.redraw()
+
+    def start_profile(self):
+        """Start a cProfile capture."""
+
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def stop_profile(self):
+        """Stop the cProfile capture, write it to a file and return the file name."""
+
+        self.profiler.disable()
+        filename = time.strftime('battleship-%Y%m%d-%H%M%S.prof')
+        self.profiler.dump_stats(filename)
+        self.profiler = None
+
+        return filename
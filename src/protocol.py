@@ -0,0 +1,133 @@
+import io
+import pickle
+import time
+
+# Hit grid encoding of BattleWin.hit_list / e_hit_list
+UNKNOWN, MISS, HIT = 0, 1, 2
+
+# Boat lengths of BattleWin.boats
+FLEET = (1, 2, 3, 4)
+
+# Sent on an otherwise idle connection so the other end knows it's alive
+HEARTBEAT = ('hb',)
+HEARTBEAT_BYTES = pickle.dumps(HEARTBEAT)
+
+# Seconds between heartbeats, and of silence before a peer counts as gone
+HEARTBEAT_INTERVAL = 2.0
+DEADLINE = 10.0
+
+
+def unpack(buffer):
+    """Split received bytes into complete messages.
+
+    Several sends can arrive in one recv, and one send can be split
+    over several. Returns a list of messages and the leftover bytes of
+    any incomplete message.
+    """
+
+    messages = list()
+    stream = io.BytesIO(buffer)
+    end = 0
+
+    while end < len(buffer):
+        try:
+            messages.append(pickle.load(stream))
+        except (EOFError, pickle.UnpicklingError): # Rest hasn't arrived yet
+            break
+        end = stream.tell()
+
+    return messages, buffer[end:]
+
+
+class TimerWheel:
+    """Notices connections that have been silent for too long.
+
+    Connections are kept in a ring of slots, one per tick, by when they
+    would expire. Hearing from a connection only records the time, and
+    each tick only looks at the one slot that is due, so the cost
+    doesn't depend on how many connections are open. A connection
+    found in its slot that has been heard from since is moved on to
+    the slot of its new expiry instead of timing out.
+    """
+
+    def __init__(self, deadline=DEADLINE, tick=HEARTBEAT_INTERVAL / 2, clock=time.monotonic):
+        """Initialize an instance.
+
+        Connections expire deadline seconds after they were last heard
+        from, give or take tick seconds.
+        """
+
+        self.deadline = deadline
+        self.tick = tick
+        self.clock = clock
+
+        # Enough slots that an expiry never wraps around past the current one
+        self.slots = [set() for i in range(int(deadline / tick) + 2)]
+
+        self.now = clock()
+        self.current = int(self.now / tick)
+
+        # Connection: time last heard from
+        self.last_seen = dict()
+
+    def __len__(self):
+        return len(self.last_seen)
+
+    def schedule(self, key, expiry):
+        """Put key in the slot for expiry, but never one already done."""
+
+        index = max(int(expiry / self.tick), self.current + 1)
+        self.slots[index % len(self.slots)].add(key)
+
+    def add(self, key):
+        """Start watching a connection."""
+
+        # The wheel may not have been advanced for a while
+        self.now = self.clock()
+        self.last_seen[key] = self.now
+        self.schedule(key, self.now + self.deadline)
+
+    def touch(self, key):
+        """Record hearing from a connection, if it's being watched."""
+
+        if key in self.last_seen:
+            self.last_seen[key] = self.now
+
+    def remove(self, key):
+        """Stop watching a connection, it's left in its slot until then."""
+        self.last_seen.pop(key, None)
+
+    def advance(self):
+        """Move up to the current time, return a list of expired connections.
+
+        Expired connections are no longer watched.
+        """
+
+        self.now = self.clock()
+        target = int(self.now / self.tick)
+
+        expired = list()
+
+        # Only a full turn of the ring after a long pause
+        start = max(self.current + 1, target - len(self.slots) + 1)
+        self.current = target
+        for index in range(start, target + 1):
+            slot = self.slots[index % len(self.slots)]
+            keys = list(slot)
+            slot.clear()
+
+            for key in keys:
+                seen = self.last_seen.get(key)
+                if seen is None: # Removed
+                    continue
+                if seen + self.deadline <= self.now:
+                    del self.last_seen[key]
+                    expired.append(key)
+                else:
+                    self.schedule(key, seen + self.deadline)
+
+        return expired
+
+    def until_tick(self):
+        """Return seconds until the next tick."""
+        return max(0.0, (self.current + 1) * self.tick - self.clock())
@@ -0,0 +1,181 @@
+from protocol import FLEET, HIT, MISS
+
+
+class Game:
+    """State of one refereed game between players 0 and 1.
+
+    Fleets and shots are stored as bitmasks with one bit per tile, so
+    a whole game is a handful of ints.
+    """
+
+    __slots__ = ('boats', 'masks', 'afloat', 'shots', 'turn', 'salvo')
+
+    def __init__(self, salvo=False):
+        """Initialize an instance.
+
+        salvo is whether players fire one shot per surviving boat each
+        turn instead of just one.
+        """
+
+        # Boats as sent by all_placed, (length, x, y, horizontal)
+        self.boats = [None, None]
+
+        # Bitmask of tiles of every boat
+        self.masks = [None, None]
+
+        # Bitmask of unhit boat tiles of each player
+        self.afloat = [0, 0]
+
+        # Bitmask of tiles shot at each player
+        self.shots = [0, 0]
+
+        # Host goes first, like BattleWin.start_game
+        self.turn = 0
+
+        self.salvo = salvo
+
+
+class Referee:
+    """Resolves shots for any number of concurrent games."""
+
+    def __init__(self, size=10, fleet=FLEET):
+        """Initialize an instance.
+
+        size is the number of rows/columns of each grid and fleet the
+        lengths of the boats each player must place.
+        """
+
+        self.size = size
+        self.fleet = sorted(fleet)
+        self.games = dict()
+        self.next_id = 0
+
+    def new_game(self, salvo=False):
+        """Start tracking a new game and return its id."""
+
+        gid = self.next_id
+        self.next_id += 1
+        self.games[gid] = Game(salvo)
+        return gid
+
+    def end_game(self, gid):
+        """Forget a game."""
+        self.games.pop(gid, None)
+
+    def place(self, gid, player, boats):
+        """Set the fleet of a player.
+
+        boats is a list of (length, x, y, horizontal) tuples. Raises
+        ValueError if it isn't the right set of boats, or any boat is
+        malformed, off the grid or overlapping another.
+        """
+
+        game = self.games[gid]
+        masks = list()
+        fleet = 0
+
+        # Whatever a player sends, it has to be a real fleet
+        if not isinstance(boats, (list, tuple)):
+            raise ValueError('not a list of boats')
+        for boat in boats:
+            if not (isinstance(boat, (list, tuple)) and len(boat) == 4
+                    and all(type(v) is int for v in boat[:3]) and type(boat[3]) is bool):
+                raise ValueError('malformed boat')
+        if sorted(boat[0] for boat in boats) != self.fleet:
+            raise ValueError('wrong boats')
+
+        for length, x, y, horizontal in boats:
+            if horizontal:
+                end_x, end_y, step = x + length, y + 1, 1
+            else:
+                end_x, end_y, step = x + 1, y + length, self.size
+
+            if x < 0 or y < 0 or end_x > self.size or end_y > self.size:
+                raise ValueError('boat off the grid')
+
+            mask = 0
+            for i in range(length):
+                mask |= 1 << (y*self.size + x + i*step)
+
+            if fleet & mask:
+                raise ValueError('overlapping boats')
+
+            fleet |= mask
+            masks.append(mask)
+
+        game.boats[player] = list(boats)
+        game.masks[player] = masks
+        game.afloat[player] = fleet
+
+    def ready(self, gid):
+        """Return whether both players have placed their boats."""
+        return None not in self.games[gid].masks
+
+    def shots_allowed(self, gid, player):
+        """Return how many shots player may fire this turn."""
+
+        game = self.games[gid]
+        if not game.salvo:
+            return 1
+
+        afloat = game.afloat[player]
+        return sum(1 for mask in game.masks[player] if mask & afloat)
+
+    def shoot(self, gid, player, shots):
+        """Resolve one turn of shots by player at their opponent's grid.
+
+        shots is a list of (x, y) tuples. Returns a tuple (results, over)
+        where results is a list of (x, y, result, sunk) tuples, result
+        being 1 for a miss or 2 for a hit and sunk the boat tuple sunk by
+        the shot or None. over is whether the turn won the game. results
+        is None if the turn wasn't allowed (not their turn, too many
+        shots, malformed, off the grid or already shot).
+        """
+
+        game = self.games[gid]
+        target = 1 - player
+
+        if game.turn != player or not self.ready(gid):
+            return None, False
+        if not isinstance(shots, (list, tuple)):
+            return None, False
+        for shot in shots:
+            if not (isinstance(shot, (list, tuple)) and len(shot) == 2
+                    and all(type(v) is int for v in shot)):
+                return None, False
+        if not 0 < len(shots) <= self.shots_allowed(gid, player):
+            return None, False
+
+        # Check the whole turn before changing anything
+        bits = 0
+        for x, y in shots:
+            if not (0 <= x < self.size and 0 <= y < self.size):
+                return None, False
+            bit = 1 << (y*self.size + x)
+            if (game.shots[target] | bits) & bit:
+                return None, False
+            bits |= bit
+
+        game.shots[target] |= bits
+        game.turn = target
+
+        results = list()
+        for x, y in shots:
+            bit = 1 << (y*self.size + x)
+
+            if not game.afloat[target] & bit:
+                results.append((x, y, MISS, None))
+                continue
+
+            game.afloat[target] &= ~bit
+
+            sunk = None
+            for i, mask in enumerate(game.masks[target]):
+                if mask & bit:
+                    if not mask & game.afloat[target]:
+                        sunk = game.boats[target][i]
+                    break
+
+            results.append((x, y, HIT, sunk))
+
+        return results, not game.afloat[target]
@@ -1,5 +1,7 @@
 from fltk import *
 
+import sprites
+
 class Ship(Fl_Box):
     """Visual representation of a ship in a battleship game."""
 
@@ -35,50 +37,63 @@ class Ship(Fl_Box):
         self.hits = [False] * self.length
 
         self.hide()
+        self.layout()
     
     def draw(self):
-        """Draw the boat and appropriate hit markers"""
-
-        super().draw()
-        
+        """Draw the boat and appropriate hit markers from the sprite cache."""
         
         # Dimension of tile, assumes square tiles
         dim = self.tile.w()
-        half = round(dim / 2)
-        
-        x, y = self.tile.x(), self.tile.y()
-        
+
+        # Sprites of the grid the boat is on
+        cache = self.tile.sprites
+
+        # Draw each tile of the boat with its hit marker, leaving
+        # whatever is around the ship rectangle alone
+        for i in range(self.length):
+            if self.length == 1:
+                part = 'single'
+            elif i == 0:
+                part = 'head'
+            elif i == self.length - 1:
+                part = 'tail'
+            else:
+                part = 'mid'
+
+            key = ('segment', part, self.horizontal, self.valid, self.hits[i])
+            rect = sprites.segment_rect(dim, part, self.horizontal)
+            if self.horizontal:
+                cache.blit(key, self.x() + (dim*i), self.y(), dim, rect)
+            else:
+                cache.blit(key, self.x(), self.y() + (dim*i), dim, rect)
+
+    def layout(self):
+        """Position the boat over its anchoring tile.
+
+        Needs to happen whenever the tile, orientation or grid size
+        changes, instead of every draw.
+        """
+
+        # Dimension of tile, assumes square tiles
+        dim = self.tile.w()
+
         if self.horizontal:
             w, h = dim*self.length, dim
         else:
             w, h = dim, dim*self.length
-        
-        # Colour ship red if invalid position
-        if self.valid:
-            fl_color(FL_DARK3)
-        else:
-            fl_color(FL_RED)
-        
-        # Draw boat rectangle
-        fl_rectf(self.x()+4, self.y()+4, w-8, h-8)
-
-        fl_color(FL_RED)
-
-        # Draw all applicable hit markers
-        for i in range(len(self.hits)):
-            if self.hits[i]:
-                if self.horizontal:
-                    x_pos = self.x() + (dim*i) + 7
-                    y_pos = self.y() + 7
-                else:
-                    x_pos = self.x() + 7
-                    y_pos = self.y() + (dim*i) + 7
-                
-                fl_pie(x_pos, y_pos, dim-14, dim-14, 0.0, 360.0)
-
-        self.resize(x, y, w, h)
+
+        # Whatever the boat was covering needs to be drawn again
+        if self.visible():
+            self.window().damage(FL_DAMAGE_ALL, self.x(), self.y(), self.w(), self.h())
+
+        self.resize(self.tile.x(), self.tile.y(), w, h)
+
+    def move(self, tile):
+        """Anchor the boat to a new tile."""
+        self.tile = tile
+        self.layout()
             
     def rotate(self):
         """Rotate the boat."""
-        self.size(self.h(), self.w())
-        self.horizontal = not self.horizontal
\ No newline at end of file
+        self.horizontal = not self.horizontal
+        self.layout()
@@ -0,0 +1,282 @@
+import time
+
+from protocol import FLEET, HIT, MISS
+
+
+class OutOfTime(Exception):
+    """Raised inside a search that has used up its time budget."""
+
+
+class Solver:
+    """Chooses shots against a hidden fleet.
+
+    Late in a game the few fleet layouts still consistent with the
+    shots so far are enumerated, and the shot that minimizes the
+    expected number of shots left is found exactly. Sunk boats are
+    revealed like in BattleWin, so a shot can end up a miss, a hit or a
+    hit that sinks a particular boat. Positions are bitmasks with one
+    bit per tile, and results are memoized on the board state, which
+    stays valid for the rest of the game.
+
+    Earlier on, or if the search runs out of time, it falls back to
+    shooting the tile covered by the most possible boat placements.
+    """
+
+    def __init__(self, size=10, fleet=FLEET, max_layouts=10, budget=0.5):
+        """Initialize an instance.
+
+        fleet is the lengths of all enemy boats. Exact search is only
+        tried with at most max_layouts consistent layouts and for at
+        most budget seconds per shot. The search grows very quickly with
+        the number of layouts, a dozen or so is the limit in practice.
+        """
+
+        self.size = size
+        self.fleet = tuple(sorted(fleet, reverse=True))
+        self.max_layouts = max_layouts
+        self.budget = budget
+
+        # Every position a boat of each length could be in
+        self.placements = {length: self.gen_placements(length) for length in set(fleet)}
+
+        # (hits, layouts): expected shots left, best shot
+        self.memo = dict()
+
+    def gen_placements(self, length):
+        """Return bitmasks of every position of a boat of passed length."""
+
+        masks = list()
+        for y in range(self.size):
+            for x in range(self.size):
+                if x + length <= self.size:
+                    masks.append(sum(1 << (y*self.size + x + i) for i in range(length)))
+                if y + length <= self.size and length > 1:
+                    masks.append(sum(1 << ((y+i)*self.size + x) for i in range(length)))
+        return masks
+
+    def reset(self):
+        """Forget memoized results, for a new game."""
+        self.memo.clear()
+
+    def mask(self, boat):
+        """Return the bitmask of a (length, x, y, horizontal) boat."""
+
+        length, x, y, horizontal = boat
+        step = 1 if horizontal else self.size
+        return sum(1 << (y*self.size + x + i*step) for i in range(length))
+
+    def best_shot(self, hit_list, sunk, exclude=()):
+        """Return (x, y) of the best tile to shoot next.
+
+        hit_list is a grid like BattleWin.e_hit_list, sunk a list of
+        (length, x, y, horizontal) tuples of sunk boats and exclude a
+        collection of (x, y) tiles not to choose.
+        """
+
+        hits = misses = 0
+        for y in range(self.size):
+            for x in range(self.size):
+                if hit_list[y][x] == HIT:
+                    hits |= 1 << (y*self.size + x)
+                elif hit_list[y][x] == MISS:
+                    misses |= 1 << (y*self.size + x)
+
+        sunk_masks = tuple(sorted(self.mask(b) for b in sunk))
+        excluded = 0
+        for x, y in exclude:
+            excluded |= 1 << (y*self.size + x)
+
+        # Finding the layouts and searching them share the budget
+        shot = None
+        deadline = time.perf_counter() + self.budget
+        try:
+            layouts = self.layouts(hits, misses, sunk_masks, deadline)
+            if layouts is not None and not excluded:
+                shot = self.search(hits, layouts, deadline)[1]
+        except OutOfTime:
+            pass
+
+        if shot is None:
+            shot = self.density_shot(hits, misses, sunk_masks, excluded)
+
+        return shot % self.size, shot // self.size
+
+    def remaining(self, sunk_masks):
+        """Return lengths of boats not sunk yet, longest first."""
+
+        lengths = list(self.fleet)
+        for mask in sunk_masks:
+            lengths.remove(bin(mask).count('1'))
+        return lengths
+
+    def layouts(self, hits, misses, sunk_masks, deadline=float('inf')):
+        """Return all layouts of unsunk boats consistent with the board.
+
+        Each layout is a tuple of boat bitmasks. Returns None if there
+        are more than max_layouts, raises OutOfTime if it takes past
+        deadline.
+        """
+
+        lengths = self.remaining(sunk_masks)
+        blocked = misses
+        for mask in sunk_masks:
+            blocked |= mask
+        open_hits = hits & ~blocked
+
+        # Unsunk boats are never completely hit, or they'd be revealed
+        options = [
+            [m for m in self.placements[length] if not m & blocked and m & ~hits]
+            for length in lengths
+        ]
+        capacity = [sum(lengths[i:]) for i in range(len(lengths))] + [0]
+
+        layouts = list()
+        boats = list()
+        nodes = [0]
+
+        def place(i, used, start):
+            if len(layouts) > self.max_layouts:
+                return
+
+            # Checking the clock every node would slow it down a lot
+            nodes[0] += 1
+            if not nodes[0] % 1000 and time.perf_counter() > deadline:
+                raise OutOfTime
+
+            if i == len(lengths):
+                if not open_hits & ~used:
+                    layouts.append(tuple(boats))
+                return
+
+            # Prune if the rest of the boats can't cover the open hits
+            if bin(open_hits & ~used).count('1') > capacity[i]:
+                return
+
+            # Boats of the same length in increasing order, so each
+            # layout only turns up once
+            first = start if i > 0 and lengths[i] == lengths[i-1] else 0
+            choices = options[i]
+            for j in range(first, len(choices)):
+                m = choices[j]
+                if not m & used:
+                    boats.append(m)
+                    place(i + 1, used | m, j + 1)
+                    boats.pop()
+
+        place(0, 0, 0)
+
+        if len(layouts) > self.max_layouts:
+            return None
+        return layouts
+
+    def search(self, hits, layouts, deadline):
+        """Return (expected shots left, best shot) over passed layouts.
+
+        layouts is a list of tuples of unsunk boat bitmasks. Results are
+        memoized on the set of layouts and the hits on them, which is all
+        that matters for the rest of the game.
+        """
+
+        union = 0
+        for layout in layouts:
+            for m in layout:
+                union |= m
+
+        key = (hits & union, frozenset(layouts))
+        if key in self.memo:
+            return self.memo[key]
+
+        if time.perf_counter() > deadline:
+            raise OutOfTime
+
+        total = len(layouts)
+
+        # How many layouts have a boat on each unshot tile
+        coverage = dict()
+        for layout in layouts:
+            unhit = 0
+            for m in layout:
+                unhit |= m
+            unhit &= ~hits
+            while unhit:
+                bit = unhit & -unhit
+                coverage[bit] = coverage.get(bit, 0) + 1
+                unhit ^= bit
+
+        # Tiles every layout has a boat on have to be shot sometime,
+        # and shooting them first only tells us more sooner
+        sure = [bit for bit, count in coverage.items() if count == total]
+        if sure:
+            candidates = sure[:1]
+        else: # Likeliest tiles first, to find a good bound early
+            candidates = sorted(coverage, key=lambda bit: -coverage[bit])
+
+        best = (float('inf'), None)
+
+        for bit in candidates:
+
+            # Group layouts by what the shot would show
+            miss_layouts = list()
+            outcomes = dict()
+            for layout in layouts:
+                for i, m in enumerate(layout):
+                    if m & bit:
+                        sunk = m if not m & ~(hits | bit) else None
+                        rest = layout[:i] + layout[i+1:] if sunk else layout
+                        outcomes.setdefault(sunk, list()).append(rest)
+                        break
+                else:
+                    miss_layouts.append(layout)
+
+            # Every outcome other than winning takes at least one more shot
+            finished = sum(len(sub) for sunk, sub in outcomes.items() if sunk and not sub[0])
+            if 1 + (total - finished) / total >= best[0]:
+                continue
+
+            expected = 1.0
+            if miss_layouts:
+                e = self.search(hits, miss_layouts, deadline)[0]
+                expected += len(miss_layouts) / total * e
+
+            for sunk, sub in outcomes.items():
+                if sunk and not sub[0]: # Last boat sunk, game over
+                    continue
+                e = self.search(hits | bit, sub, deadline)[0]
+                expected += len(sub) / total * e
+
+            if expected < best[0]:
+                best = (expected, bit.bit_length() - 1)
+
+        self.memo[key] = best
+        return best
+
+    def density_shot(self, hits, misses, sunk_masks, excluded=0):
+        """Return the unshot tile covered by the most possible boat placements.
+
+        Placements over open hits count for a lot more, to finish off
+        boats that have been found.
+        """
+
+        blocked = misses
+        for mask in sunk_masks:
+            blocked |= mask
+        open_hits = hits & ~blocked
+
+        unshot = ~(hits | misses | excluded) & ((1 << self.size**2) - 1)
+        scores = [0] * self.size**2
+
+        for length in self.remaining(sunk_masks):
+            for m in self.placements[length]:
+                if m & blocked or not m & ~hits:
+                    continue
+
+                weight = 1 + 50 * bin(m & open_hits).count('1')
+                free = m & unshot
+                while free:
+                    bit = free & -free
+                    scores[bit.bit_length() - 1] += weight
+                    free ^= bit
+
+        # Any unshot tile if nothing fits, shouldn't really happen
+        best = max(range(self.size**2), key=lambda i: (scores[i], (unshot >> i) & 1))
+        return best
@@ -0,0 +1,98 @@
+from fltk import *
+
+
+def draw_tile(dim, marker):
+    """Draw a tile at 0, 0 with a hit, miss or pending marker (or None)."""
+
+    fl_draw_box(FL_BORDER_BOX, 0, 0, dim, dim, FL_BLUE)
+
+    colours = {'hit': FL_RED, 'miss': FL_WHITE, 'pending': FL_YELLOW}
+    if marker is not None:
+        fl_color(colours[marker])
+        fl_pie(4, 4, dim - 8, dim - 8, 0.0, 360.0)
+
+
+def segment_rect(dim, part, horizontal):
+    """Return x, y, w, h of the ship rectangle in one tile of a ship.
+
+    part is 'single', 'head', 'mid' or 'tail', the ship rectangle is
+    inset from the tile edges only at its ends.
+    """
+
+    start = 4 if part in ('single', 'head') else 0
+    end = dim - 4 if part in ('single', 'tail') else dim
+    if horizontal:
+        return start, 4, end - start, dim - 8
+    return 4, start, dim - 8, end - start
+
+
+def draw_segment(dim, part, horizontal, valid, hit):
+    """Draw one tile of a ship at 0, 0.
+
+    Only the segment_rect part is meant to be copied, the rest is left
+    to whatever is underneath, like a grid or nothing at all.
+    """
+
+    # Colour ship red if invalid position
+    fl_color(FL_DARK3 if valid else FL_RED)
+    fl_rectf(*segment_rect(dim, part, horizontal))
+
+    if hit:
+        fl_color(FL_RED)
+        fl_pie(7, 7, dim - 14, dim - 14, 0.0, 360.0)
+
+
+class SpriteCache:
+    """Offscreen images of tiles and ship segments for one tile size.
+
+    Sprites are drawn the first time they're needed and copied to the
+    window after that. Each grid has its own, cleared when the grid's
+    tile size changes.
+    """
+
+    renderers = {'tile': draw_tile, 'segment': draw_segment}
+
+    def __init__(self):
+        """Initialize an instance."""
+
+        self.dim = None
+        self.sprites = dict()
+
+    def blit(self, key, x, y, dim, rect=None):
+        """Copy the sprite for key to x, y, drawing it first if needed.
+
+        key is a tuple of the renderer name and its arguments after dim.
+        rect is the x, y, w, h part of the sprite to copy, all of it if
+        None.
+        """
+
+        # Shouldn't happen, the owning grid clears it on resize
+        if dim != self.dim:
+            self.clear()
+            self.dim = dim
+
+        off = self.sprites.get(key)
+        if off is None:
+            off = self.render(key, dim)
+            self.sprites[key] = off
+
+        sx, sy, w, h = rect if rect is not None else (0, 0, dim, dim)
+        fl_copy_offscreen(x + sx, y + sy, w, h, off, sx, sy)
+
+    def render(self, key, dim):
+        """Draw the sprite for key into a new offscreen buffer."""
+
+        off = fl_create_offscreen(dim, dim)
+        fl_begin_offscreen(off)
+        self.renderers[key[0]](dim, *key[1:])
+        fl_end_offscreen()
+
+        return off
+
+    def clear(self):
+        """Delete all sprites."""
+
+        for off in self.sprites.values():
+            fl_delete_offscreen(off)
+        self.sprites.clear()
+
@@ -0,0 +1,189 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.battleship_stats.db')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    player TEXT NOT NULL,
+    opponent TEXT,
+    won INTEGER NOT NULL,
+    shots INTEGER NOT NULL,
+    hits INTEGER NOT NULL,
+    ended REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS games_player ON games (player, ended);
+
+CREATE TABLE IF NOT EXISTS players (
+    name TEXT PRIMARY KEY,
+    wins INTEGER NOT NULL,
+    losses INTEGER NOT NULL,
+    shots INTEGER NOT NULL,
+    hits INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS players_wins ON players (wins DESC);
+
+CREATE TABLE IF NOT EXISTS heatmap (
+    player TEXT NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    hits INTEGER NOT NULL,
+    PRIMARY KEY (player, x, y)
+) WITHOUT ROWID;
+'''
+
+
+class StatsStore:
+    """Persistent player statistics in a SQLite database.
+
+    Finished games are queued and written in batches by a background
+    thread, so recording a game never waits on the disk. Per-player
+    totals are kept up to date as games are written, so lookups and
+    leaderboards are single indexed queries however many games there are.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, batch_size=500):
+        """Initialize an instance.
+
+        path is the database file, batch_size the most games written
+        in one transaction. Raises sqlite3.Error if the database can't
+        be opened or set up.
+        """
+
+        self.path = path
+        self.batch_size = batch_size
+
+        self.queue = queue.Queue()
+
+        # Set up here so a bad path fails straight away, not in the
+        # writer thread. Only the writer uses this connection after.
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            # Readers don't block the writer or the other way round
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+        except sqlite3.Error:
+            conn.close()
+            raise
+
+        self.thread = threading.Thread(target=self.writer, args=(conn,), daemon=True)
+        self.thread.start()
+
+        # Separate connection for reading on the caller's thread
+        self.conn = sqlite3.connect(self.path)
+
+    def record_game(self, player, opponent, won, hit_list):
+        """Queue a finished game to be written.
+
+        hit_list is the grid of the player's shots, like
+        BattleWin.e_hit_list.
+        """
+
+        hits = [(x, y) for y, row in enumerate(hit_list) for x, v in enumerate(row) if v == 2]
+        shots = sum(1 for row in hit_list for v in row if v != 0)
+
+        self.queue.put((player, opponent, won, shots, hits, time.time()))
+
+    def writer(self, conn):
+        """Write queued games in batches with passed connection until closed."""
+
+        done = False
+        while not done:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            # None means close once everything before it is written
+            if None in batch:
+                done = True
+                batch = [g for g in batch if g is not None]
+
+            # A failed batch is lost, but the writer carries on
+            try:
+                if batch:
+                    self.write(conn, batch)
+            except sqlite3.Error as e:
+                print(f'Could not write statistics: {e}')
+            finally:
+                for i in range(len(batch) + done):
+                    self.queue.task_done()
+
+        conn.close()
+
+    def write(self, conn, batch):
+        """Write a batch of games in one transaction."""
+
+        games = list()
+        players = list()
+        heat = list()
+        for player, opponent, won, shots, hits, ended in batch:
+            games.append((player, opponent, int(won), shots, len(hits), ended))
+            players.append((player, int(won), int(not won), shots, len(hits)))
+            heat.extend((player, x, y) for x, y in hits)
+
+        with conn:
+            conn.executemany(
+                'INSERT INTO games (player, opponent, won, shots, hits, ended) '
+                'VALUES (?, ?, ?, ?, ?, ?)', games)
+            conn.executemany(
+                'INSERT INTO players (name, wins, losses, shots, hits) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (name) DO UPDATE SET '
+                'wins = wins + excluded.wins, losses = losses + excluded.losses, '
+                'shots = shots + excluded.shots, hits = hits + excluded.hits', players)
+            conn.executemany(
+                'INSERT INTO heatmap (player, x, y, hits) VALUES (?, ?, ?, 1) '
+                'ON CONFLICT (player, x, y) DO UPDATE SET hits = hits + 1', heat)
+
+    def flush(self):
+        """Wait until every queued game has been written."""
+        self.queue.join()
+
+    def close(self):
+        """Write any queued games and stop the writer."""
+
+        self.queue.put(None)
+        self.thread.join()
+        self.conn.close()
+
+    def player(self, name):
+        """Return a dict of a player's totals, or None if they haven't played.
+
+        Includes wins, losses, shots, hits, accuracy and shots per game.
+        """
+
+        row = self.conn.execute(
+            'SELECT wins, losses, shots, hits FROM players WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return None
+
+        wins, losses, shots, hits = row
+        return {
+            'wins': wins,
+            'losses': losses,
+            'shots': shots,
+            'hits': hits,
+            'accuracy': hits / shots if shots else 0.0,
+            'shots_per_game': shots / (wins + losses),
+        }
+
+    def leaderboard(self, n=10):
+        """Return a list of (name, wins, losses) of the n players with most wins."""
+
+        return self.conn.execute(
+            'SELECT name, wins, losses FROM players ORDER BY wins DESC LIMIT ?', (n,)).fetchall()
+
+    def heatmap(self, name, size=10):
+        """Return a size x size grid of how often a player has hit each tile."""
+
+        grid = [[0] * size for i in range(size)]
+        for x, y, hits in self.conn.execute(
+                'SELECT x, y, hits FROM heatmap WHERE player = ?', (name,)):
+            grid[y][x] = hits
+        return grid
@@ -2,19 +2,33 @@ from fltk import *
 
 from getpass import getuser
 
-import grid, ship, network, game_end
+import sqlite3
+
+import grid, ship, network, game_end, referee, perf, solver, stats
 
 class BattleWin(Fl_Double_Window):
     """Digital game of battleship.
     
-    To be played with 2 computers over a local network, or on the same
-    computer, though that's really just for testing.
+    To be played with 2 computers over a local network, or with two
+    windows on the same computer using Game/Local Game.
     """
 
-    def __init__(self, w, h):
-        """Initialize an instance."""
+    def __init__(self, w, h, stats_store=None):
+        """Initialize an instance.
+
+        stats_store is a StatsStore to record games in, a new one using
+        the default database if None.
+        """
 
         super().__init__(w, h, 'Battleship')
+
+        # Statistics are off if the database can't be opened
+        if stats_store is None:
+            try:
+                stats_store = stats.StatsStore()
+            except sqlite3.Error as e:
+                print(f'Statistics disabled: {e}')
+        self.stats = stats_store
         
         # Index of boat currently being placed
         self.placing = -1
@@ -25,6 +39,26 @@ class BattleWin(Fl_Double_Window):
         self.turn = False
 
         self.connection = None
+
+        # Connected player's name, for statistics
+        self.enemy_name = None
+
+        # Second window of a Game/Local Game
+        self.local_opponent = None
+
+        # Referee mode, host resolves all shots and keeps both fleets.
+        # Only the host has a Referee object
+        self.referee_mode = False
+        self.referee = None
+        self.game_id = None
+
+        # Salvo mode, one shot per surviving boat each turn.
+        # Shots chosen so far this turn, sent together
+        self.salvo = False
+        self.salvo_shots = list()
+
+        # Set by a hub, where neither player is the Server
+        self.goes_first = False
         
         # Will be a list of boats once connected & enemy placed.
         self.enemy_boats = None
@@ -49,8 +83,17 @@ class BattleWin(Fl_Double_Window):
         menuitems = (
             ('Game', 0, 0, 0, FL_SUBMENU),
                 ('Host Game', 0, self.host_cb),
+                ('Host Refereed Game', 0, self.host_referee_cb),
                 ('Join Game', 0, self.conn_cb),
+                ('Local Game', 0, self.local_cb),
                 ('Disconnect', 0, self.disconn_cb),
+                ('Salvo Mode', 0, None, 0, FL_MENU_TOGGLE),
+                ('Hint', 0, self.hint_cb),
+                ('Statistics', 0, self.stats_cb),
+                (None, 0),
+            ('Debug', 0, 0, 0, FL_SUBMENU),
+                ('Performance Overlay', 0, self.overlay_cb, 0, FL_MENU_TOGGLE),
+                ('Profiler', 0, self.profiler_cb, 0, FL_MENU_TOGGLE),
                 (None, 0)
         )
         
@@ -81,6 +124,20 @@ class BattleWin(Fl_Double_Window):
         self.e_hit_list = [[0 for i in range(c)] for x in range(c)]
 
         self.size_range(510, 330)
+
+        # For hints, enemy fleet is the same as ours
+        self.solver = solver.Solver(c, [b.length for b in self.boats])
+
+        # Draw timings of every widget class, and callbacks they come from
+        draws = [BattleWin, ResizeGrids, grid.Grid, grid.Tile, ship.Ship]
+        callbacks = [
+            (BattleWin, 'handle'),
+            (BattleWin, 'recv_data'),
+            (BattleWin, 'connected_cb'),
+            (BattleWin, 'disconn_cb'),
+            (BattleWin, 'tile_clicked')
+        ]
+        self.perf = perf.PerfMonitor(self, draws, callbacks)
     
     def connected_cb(self):
         """Change label and send username once connected."""
@@ -90,6 +147,8 @@ class BattleWin(Fl_Double_Window):
             self.status_box.label('Connected. Place your boats in the left grid (right click to rotate).')
 
             self.connection.send_data(getuser())
+            rules = {'referee': self.referee_mode, 'salvo': self.salvo}
+            self.connection.send_data(('rules', rules))
 
             # Start placing boats
             self.start_placing()
@@ -99,16 +158,38 @@ class BattleWin(Fl_Double_Window):
 
         # Create server
         self.connection = network.Server(self)
+        self.hosting()
+
+    def hosting(self):
+        """Set the rules and options once hosting a game."""
+
+        # Host decides the rules
+        self.salvo = bool(self.menubar.find_item('Game/Salvo Mode').value())
 
         # Deactivate options
         self.conn_but.deactivate()
         self.menubar.find_item('Game/Join Game').deactivate()
         self.host_but.deactivate()
         self.menubar.find_item('Game/Host Game').deactivate()
+        self.menubar.find_item('Game/Host Refereed Game').deactivate()
+        self.menubar.find_item('Game/Local Game').deactivate()
 
         self.host_but.label('WAITING...')
         self.status_box.label('Waiting for a connection.')
 
+    def host_referee_cb(self, wid=None):
+        """Host a game where this game resolves all shots.
+
+        The opponent never receives the host's fleet, but the host still
+        receives the opponent's, only the host's fleet is protected.
+        """
+
+        self.referee_mode = True
+        self.referee = referee.Referee(self.resize_grids.player_grid.c, [b.length for b in self.boats])
+
+        self.host_cb()
+        self.game_id = self.referee.new_game(self.salvo)
+
     def conn_cb(self, wid=None):
         """Join an existing game."""
 
@@ -121,10 +202,17 @@ class BattleWin(Fl_Double_Window):
             m = 'ERROR CONNECTING:\nEnsure other player has clicked host game and check IP + ports.'
             fl_alert(m)
             return 0
+
+        self.joined()
+
+    def joined(self):
+        """Start the game once connected to a host."""
         
         # Deactivate options
         self.host_but.deactivate()
         self.menubar.find_item('Game/Host Game').deactivate()
+        self.menubar.find_item('Game/Host Refereed Game').deactivate()
+        self.menubar.find_item('Game/Local Game').deactivate()
         self.conn_but.deactivate()
         self.menubar.find_item('Game/Join Game').deactivate()
 
@@ -134,6 +222,20 @@ class BattleWin(Fl_Double_Window):
         self.connection.send_data(getuser())
         self.start_placing()
 
+    def local_cb(self, wid=None):
+        """Host a game against a second window on this computer.
+
+        The two windows talk over a socketpair instead of TCP.
+        """
+
+        # Keep a reference so the window doesn't get garbage collected
+        other = self.local_opponent = BattleWin(self.w(), self.h(), self.stats)
+        other.show()
+
+        self.connection, other.connection = network.local_pair(self, other)
+        self.hosting()
+        other.joined()
+
     def disconn_cb(self, wid=None):
         """Disconnect from another game if connected and reset the game."""
 
@@ -142,10 +244,18 @@ class BattleWin(Fl_Double_Window):
         if self.connection is not None:
             self.connection.close()
             self.connection = None
+
+        self.referee_mode = False
+        self.referee = None
+        self.game_id = None
+        self.salvo = False
+        self.goes_first = False
         
         # Reactivate network options
         self.host_but.activate()
         self.menubar.find_item('Game/Host Game').activate()
+        self.menubar.find_item('Game/Host Refereed Game').activate()
+        self.menubar.find_item('Game/Local Game').activate()
         self.conn_but.activate()
         self.menubar.find_item('Game/Join Game').activate()
         self.host_but.label('Host Game')
@@ -155,6 +265,63 @@ class BattleWin(Fl_Double_Window):
 
         self.reset_game()
 
+    def hint_cb(self, wid=None):
+        """Suggest a tile to attack."""
+
+        if not self.turn:
+            return
+
+        # Only boats that have been sunk are known
+        sunk = [
+            (b.length, b.tile.x_ind, b.tile.y_ind, b.horizontal)
+            for b in (self.enemy_boats or [])
+            if not b.retired and all(b.hits)
+        ]
+        x, y = self.solver.best_shot(self.e_hit_list, sunk, self.salvo_shots)
+
+        self.status_box.label(f'Hint: try column {x + 1}, row {y + 1} of the rightmost grid.')
+
+    def stats_cb(self, wid=None):
+        """Show the player's statistics and the leaderboard."""
+
+        if self.stats is None:
+            fl_message('Statistics are unavailable, the database could not be opened.')
+            return
+
+        lines = list()
+
+        record = self.stats.player(getuser())
+        if record is None:
+            lines.append('No games played yet.')
+        else:
+            lines.append(f"{record['wins']} wins, {record['losses']} losses")
+            lines.append(f"{record['shots_per_game']:.1f} shots per game, {record['accuracy']:.0%} accuracy")
+
+        lines.append('')
+        lines.append('Most wins:')
+        for name, wins, losses in self.stats.leaderboard(5):
+            lines.append(f'{name}: {wins} - {losses}')
+
+        fl_message('\n'.join(lines))
+
+    def overlay_cb(self, wid=None):
+        """Show or hide the performance overlay."""
+
+        if self.menubar.find_item('Debug/Performance Overlay').value():
+            self.perf.enable()
+        else:
+            self.perf.disable()
+
+    def profiler_cb(self, wid=None):
+        """Start or stop a cProfile capture."""
+
+        if self.menubar.find_item('Debug/Profiler').value():
+            self.perf.start_profile()
+            self.status_box.label('Profiling...')
+        else:
+            filename = self.perf.stop_profile()
+            self.status_box.label(f'Profile written to {filename}.')
+
     def recv_data(self, data):
         """Receive data from the connected game"""
 
@@ -162,8 +329,13 @@ class BattleWin(Fl_Double_Window):
         if isinstance(data, str):
             if data == getuser():
                 data += '2'
+            self.enemy_name = data
             self.ename_label.label('\n'.join(list(data.upper())))
 
+        # Rules and refereed game messages
+        elif isinstance(data, tuple):
+            self.recv_message(data)
+
         # Receiving enemy boat locations
         elif not self.enemy_placed:
             self.get_enemy_boats(data)
@@ -172,13 +344,63 @@ class BattleWin(Fl_Double_Window):
             self.hit_list = data
             self.resize_grids.player_grid.update_visuals(self.hit_list)
             self.update_boat_hits()
-            self.turn = True
-            self.status_box.label('Choose a tile in the rightmost grid to attack.')
+            self.start_turn()
+
+    def recv_message(self, msg):
+        """Respond to a tagged tuple message from the connected game."""
+
+        kind = msg[0] if msg else None
+
+        if kind == 'rules':
+            self.referee_mode = msg[1].get('referee', False)
+            self.salvo = msg[1].get('salvo', False)
+            self.goes_first = msg[1].get('first', False)
+
+        # Host has placed, but won't tell us where
+        elif kind == 'placed':
+            self.enemy_placed = True
+            if self.placed:
+                self.start_game()
+
+        # Host resolving a turn of shots at its fleet
+        elif kind == 'shot' and self.referee is not None and len(msg) == 2:
+            results, over = self.referee.shoot(self.game_id, 1, msg[1])
+            if results is None: # Not allowed, ignore it
+                return
+
+            for x, y, result, sunk in results:
+                self.hit_list[y][x] = result
+            self.connection.send_data(('result', results, over))
+
+            self.resize_grids.player_grid.update_visuals(self.hit_list)
+            self.update_boat_hits()
+            self.start_turn()
+
+        # Host telling us what our shots did
+        elif kind == 'result':
+            results, over = msg[1:]
+
+            # Only sunk boats are ever revealed
+            sunk_boats = list()
+            for x, y, result, sunk in results:
+                self.e_hit_list[y][x] = result
+                if sunk is not None:
+                    sunk_boats.append(sunk)
+
+            self.resize_grids.enemy_grid.update_visuals(self.e_hit_list)
+
+            for b in self.add_enemy_boats(sunk_boats):
+                b.hits = [True] * b.length
+                b.show()
+
+            if over:
+                self.gameover(True)
 
     def reset_game(self):
         """Reset the game."""
 
         self.turn = False
+        self.salvo_shots = list()
         self.enemy_placed = False
         self.placed = False
         self.placing = -1
@@ -190,21 +412,21 @@ class BattleWin(Fl_Double_Window):
         # new games will just keep creating more and more enemy boats
         if self.enemy_boats is not None:
             for b in self.enemy_boats:
-                b.tile = self.resize_grids.enemy_grid.tiles[0][0]
                 b.placed = False
                 b.valid = False
                 b.hits = [False] * b.length
                 b.horizontal = True
+                b.move(self.resize_grids.enemy_grid.tiles[0][0])
                 b.retired = True
                 b.hide()
 
         # Reset boats
         for b in self.boats:
-            b.tile = self.resize_grids.enemy_grid.tiles[0][0]
             b.placed = False
             b.valid = False
             b.hits = [False] * b.length
             b.horizontal = True
+            b.move(self.resize_grids.enemy_grid.tiles[0][0])
             b.hide()
 
         c = self.resize_grids.player_grid.c
@@ -216,23 +438,50 @@ class BattleWin(Fl_Double_Window):
         self.resize_grids.enemy_grid.update_visuals(self.e_hit_list)
 
         self.ename_label.label('E\nN\nE\nM\nY')
+        self.enemy_name = None
+
+        self.solver.reset()
+
+        if self.referee is not None:
+            self.referee.end_game(self.game_id)
+            self.game_id = self.referee.new_game(self.salvo)
 
     def get_enemy_boats(self, boats):
         """Create enemy boats off of data connected game has sent."""
 
+        # Check the fleet before setting anything up, it could be anything
+        if self.referee is not None:
+            try:
+                self.referee.place(self.game_id, 1, boats)
+            except (ValueError, TypeError):
+                self.disconn_cb()
+                self.status_box.label('Opponent sent an invalid fleet. Host a game or join a game to start.')
+                return
+
         self.enemy_placed = True
+        self.add_enemy_boats(boats)
+
+        # Start the game if self boats placed as well
+        if self.placed:
+            self.start_game()
+
+    def add_enemy_boats(self, boats):
+        """Create and return hidden enemy boats from (length, x, y, horizontal) tuples."""
+
         tiles = self.resize_grids.enemy_grid.tiles
         
         self.boatgroup.begin()
 
+        new_boats = [ship.Ship(b[0], tiles[b[2]][b[1]], b[3]) for b in boats]
+
         # When game gets reset, old enemy boats are kept to avoid deletion problems
         # So need to add to list and not reset
         if self.enemy_boats is None:
-            self.enemy_boats = [ship.Ship(b[0], tiles[b[2]][b[1]], b[3]) for b in boats]
+            self.enemy_boats = new_boats
         else:
-            self.enemy_boats.extend([ship.Ship(b[0], tiles[b[2]][b[1]], b[3]) for b in boats])
+            self.enemy_boats.extend(new_boats)
         
-        for b in self.enemy_boats:
+        for b in new_boats:
             b.valid = True
             b.placed = True
             x, y = b.tile.x_ind, b.tile.y_ind
@@ -240,9 +489,7 @@ class BattleWin(Fl_Double_Window):
 
         self.boatgroup.end()
 
-        # Start the game if self boats placed as well
-        if self.placed:
-            self.start_game()
+        return new_boats
 
     def start_placing(self):
         """Start placing of boats."""
@@ -266,9 +513,7 @@ class BattleWin(Fl_Double_Window):
                 
                 # Move on to the next boat
                 if self.placing < len(self.boats) - 1:
-                    wid = Fl.belowmouse()
-                    if isinstance(wid, grid.Tile):
-                        self.boats[self.placing+1].tile = wid
+                    self.boats[self.placing+1].move(boat.tile)
                     self.placing += 1
                 
                 # Wait for opponent or start game if all placed
@@ -282,26 +527,51 @@ class BattleWin(Fl_Double_Window):
         self.placed = True
 
         boats = [(b.length, b.tile.x_ind, b.tile.y_ind, b.horizontal) for b in self.boats]
-        self.connection.send_data(boats)
+
+        # Refereeing host keeps its fleet to itself
+        if self.referee is not None:
+            self.referee.place(self.game_id, 0, boats)
+            self.connection.send_data(('placed',))
+        else:
+            self.connection.send_data(boats)
 
         # Start game if enemy has also placed their boats
-        if self.enemy_boats is not None and not all([b.retired for b in self.enemy_boats]):
+        if self.enemy_placed:
             self.start_game()
         else:
             self.status_box.label('All placed. Waiting for your opponent to place their ships.')
 
     def start_game(self):
-        """Start a game, server always goes first."""
+        """Start a game, server (or whoever a hub picked) goes first."""
 
         # Server goes first
-        if isinstance(self.connection, network.Server): # TODO add random turn choice
-            self.turn = True
-        
-        if self.turn:
-            self.status_box.label('Choose a tile in the rightmost grid to attack.')
+        if isinstance(self.connection, network.Server) or self.goes_first: # TODO add random turn choice
+            self.start_turn()
         else:
             self.status_box.label('Waiting for your opponent to take their turn.')
 
+    def start_turn(self):
+        """Let the player choose their shots for this turn."""
+
+        self.turn = True
+        self.salvo_shots = list()
+
+        if self.salvo:
+            self.status_box.label(f'Choose {self.shots_left()} tiles in the rightmost grid to attack.')
+        else:
+            self.status_box.label('Choose a tile in the rightmost grid to attack.')
+
+    def shots_left(self):
+        """Return how many more shots can be chosen this turn."""
+
+        if not self.salvo:
+            return 1 - len(self.salvo_shots)
+
+        # One shot per surviving boat, but no more than there are tiles to shoot
+        afloat = sum(1 for b in self.boats if not all(b.hits))
+        unshot = sum(row.count(0) for row in self.e_hit_list)
+        return min(afloat, unshot) - len(self.salvo_shots)
+
     def tile_clicked(self, tile):
         """Check validity of a tile click and respond accordingly."""
 
@@ -310,23 +580,49 @@ class BattleWin(Fl_Double_Window):
                 x, y = tile.x_ind, tile.y_ind # For convenience
 
                 # Don't do anything if already clicked
-                if self.e_hit_list[y][x] != 0: 
+                if self.e_hit_list[y][x] != 0 or (x, y) in self.salvo_shots:
                     return
-                
-                for b in self.enemy_boats:
-                    if b.retired: continue # Part of hack to make resetting work
-
-                    if (x, y) in b.locations:
-                        self.e_hit_list[y][x] = 2
-                        self.hit_boat(b)
-                        break
-                else: # MISS
-                    self.e_hit_list[y][x] = 1
-                
-                self.connection.send_data(self.e_hit_list)
-                self.resize_grids.enemy_grid.update_visuals(self.e_hit_list)
-                self.turn = False
-                self.status_box.label('Waiting for your opponent to take their turn.')
+
+                self.salvo_shots.append((x, y))
+                tile.pending = True
+                tile.redraw()
+
+                # Wait for the rest of the salvo
+                left = self.shots_left()
+                if left > 0:
+                    self.status_box.label(f'Choose {left} more tiles in the rightmost grid to attack.')
+                    return
+
+                self.fire()
+
+    def fire(self):
+        """Resolve and send all shots chosen this turn."""
+
+        self.turn = False
+        self.status_box.label('Waiting for your opponent to take their turn.')
+
+        # Let the refereeing host resolve the shots
+        if self.referee_mode and self.referee is None:
+            self.connection.send_data(('shot', self.salvo_shots))
+            return
+
+        if self.referee is not None:
+            self.referee.shoot(self.game_id, 0, self.salvo_shots)
+
+        for x, y in self.salvo_shots:
+            for b in self.enemy_boats:
+                if b.retired: continue # Part of hack to make resetting work
+
+                if (x, y) in b.locations:
+                    self.e_hit_list[y][x] = 2
+                    self.hit_boat(b)
+                    break
+            else: # MISS
+                self.e_hit_list[y][x] = 1
+
+        # Whole turn goes in one message and one redraw
+        self.connection.send_data(self.e_hit_list)
+        self.resize_grids.enemy_grid.update_visuals(self.e_hit_list)
 
     def hit_boat(self, boat):
         """Respond to a hit on an enemy boat."""
@@ -370,6 +666,10 @@ class BattleWin(Fl_Double_Window):
         else:
             self.gameover(False)
 
+        # Refereeing host tells us when we've won
+        if self.referee_mode and self.referee is None:
+            return
+
         # Check enemy boats
         for b in self.enemy_boats:
             if b.retired: # Ignore retired boats, part of resetting hack
@@ -381,6 +681,12 @@ class BattleWin(Fl_Double_Window):
 
     def gameover(self, victory):
         """End the game and show popup according to win/loss."""
+
+        # Written in the background by the stats store. Both windows of a
+        # local game are the same user, so only the hosting one counts
+        if self.stats is not None and not isinstance(self.connection, network.LocalClient):
+            self.stats.record_game(getuser(), self.enemy_name, victory, self.e_hit_list)
+
         end_message = game_end.GameEndWin(victory, self)
         end_message.show()
 
@@ -401,23 +707,23 @@ class BattleWin(Fl_Double_Window):
         elif event == FL_MOVE:
             if self.placing >= 0:
                 
-                wid = Fl.belowmouse()
                 boat = self.boats[self.placing]
 
-                grids = (
-                   self.resize_grids.player_grid.wid_in(wid),
-                   self.resize_grids.enemy_grid.wid_in(wid)
-                )
+                # Hit test with the grids' layout tables
+                x, y = Fl.event_x(), Fl.event_y()
+                player_tile = self.resize_grids.player_grid.tile_at(x, y)
+                tile = player_tile or self.resize_grids.enemy_grid.tile_at(x, y)
                 
-                if any(grids):
+                if tile is not None:
+                    if boat.tile is not tile:
+                        boat.move(tile)
+
                     if not boat.visible():
                         boat.show()
                     
                     # Check validity if on right grid, auto False otherwise
-                    boat.valid = self.valid_boat() if grids[0] else False
+                    boat.valid = self.valid_boat() if player_tile else False
                     
-                    if boat.tile != wid:
-                        boat.tile = wid
                     boat.redraw()
                 
                 # Hide the boat if it mouse isn't in any grid
@@ -480,14 +786,13 @@ class BattleWin(Fl_Double_Window):
 
         return self.boat_validpos() and not self.boat_overlap()
 
-    def draw(self):
-        """Add a whole ton of redrawing to make resizing work."""
-        
-        super().draw()
+    def resize(self, x, y, w, h):
+        """Extend resize to lay out boats over the resized grids."""
 
-        # This causes some annoying flickering on linux/school computers 
-        # but actually looks perfectly fine on windows
-        Fl.add_timeout(0, self.redraw)
+        super().resize(x, y, w, h)
+
+        for b in self.boats + (self.enemy_boats or []):
+            b.layout()
 
     def hide(self):
         """Close the connection before hiding."""
@@ -525,14 +830,17 @@ class ResizeGrids(Fl_Group):
 
         self.resizable(None)
     
-    def draw(self):
+    def resize(self, x, y, w, h):
+        """Extend Fl_Group resize to lay out the grids for the new size."""
+
+        super().resize(x, y, w, h)
+        self.layout()
+
+    def layout(self):
         """Center and resize child grids properly.
         
         Assumes both grids have the same dimensions.
         """
-    
-        super().draw()
-
 
         dim = self.getdim()
         